@@ -0,0 +1,146 @@
+"""End-to-end latency/throughput benchmark for /api/generate_image.
+
+Runs in-process against the offline fake backends by default, so it costs nothing:
+
+    cd app
+    python -m benchmarks.generation_benchmark --requests 100 --concurrency 20
+
+Pass --url to drive a running server instead (its backends are whatever it was
+started with). Fake backend behaviour is set with the FAKE_* environment variables
+read by services/backends.py, e.g. FAKE_GENERATOR_LATENCY=2 FAKE_EVALUATOR_SCORES=5,7,9.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def make_client(url):
+    if url:
+        import requests
+
+        session = requests.Session()
+
+        class RemoteClient:
+            def post(self, path, **kwargs):
+                return session.post(url.rstrip('/') + path, **kwargs)
+
+            def get(self, path, **kwargs):
+                return session.get(url.rstrip('/') + path, **kwargs)
+
+        return RemoteClient(), None
+
+    # In-process: fake backends and a throwaway data directory unless configured otherwise
+    os.environ.setdefault('IMAGE_BACKEND', 'fake')
+    os.environ.setdefault('EVALUATOR_BACKEND', 'fake')
+    os.environ.setdefault('IMAGES_DATA_DIR', tempfile.mkdtemp(prefix='benchmark_images_'))
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    from fastapi.testclient import TestClient
+    import main
+
+    return TestClient(main.app), main.get_router()
+
+
+def run_request(client, payload, poll_interval):
+    started = time.perf_counter()
+    response = client.post('/api/generate_image', json=payload)
+    response.raise_for_status()
+    job_id = response.json()['job_id']
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').json()
+        if job['status'] in ('completed', 'failed', 'cancelled'):
+            return time.perf_counter() - started, job
+        time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Base URL of a running server; omit to benchmark in-process with fakes')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=None)
+    parser.add_argument('--beam-width', type=int, default=None)
+    parser.add_argument('--duplicates', action='store_true',
+                        help='Send the same prompt every time to exercise caching and coalescing')
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    client, router = make_client(args.url)
+    run_id = uuid.uuid4().hex[:8]
+
+    def payload(i):
+        prompt = f"Benchmark banner {run_id}" if args.duplicates else f"Benchmark banner {run_id} #{i}"
+        body = {'user_input': prompt}
+        if args.rounds is not None:
+            body['rounds'] = args.rounds
+        if args.beam_width is not None:
+            body['beam_width'] = args.beam_width
+        return body
+
+    rss_before = rss_bytes() if router else None
+    cache_before = router.image_generator.image_manager.image_cache.current_bytes if router else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(lambda i: run_request(client, payload(i), args.poll_interval),
+                                     range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, job in outcomes if job['status'] == 'completed']
+    failures = sum(1 for _, job in outcomes if job['status'] == 'failed')
+    results = [job['result'] for _, job in outcomes if job['status'] == 'completed']
+
+    print(f"Requests: {args.requests}  concurrency: {args.concurrency}  completed: {len(latencies)}  "
+          f"failures: {failures}")
+    print(f"Wall time: {elapsed:.2f}s  throughput: {len(latencies) / elapsed:.2f} req/s")
+    if latencies:
+        print(f"Latency p50: {percentile(latencies, 50):.2f}s  p95: {percentile(latencies, 95):.2f}s  "
+              f"p99: {percentile(latencies, 99):.2f}s  max: {max(latencies):.2f}s")
+        print(f"Rounds per request: mean {statistics.mean(r.get('rounds', 0) for r in results):.2f}")
+        cached = sum(1 for r in results if r.get('cached'))
+        print(f"Cache hits: {cached}")
+
+    stage_totals = {}
+    for result in results:
+        for stage, seconds in (result.get('timings') or {}).items():
+            stage_totals.setdefault(stage, []).append(seconds)
+    if stage_totals:
+        print("Per-request stage time (mean seconds, summed over candidates):")
+        for stage, values in sorted(stage_totals.items()):
+            print(f"  {stage:<10} {statistics.mean(values):.3f}")
+
+    if router:
+        rss_after = rss_bytes()
+        cache_after = router.image_generator.image_manager.image_cache.current_bytes
+        print(f"Image cache: {cache_before / 1e6:.1f} MB -> {cache_after / 1e6:.1f} MB")
+        if rss_before is not None and rss_after is not None:
+            print(f"Process RSS: {rss_before / 1e6:.1f} MB -> {rss_after / 1e6:.1f} MB "
+                  f"(+{(rss_after - rss_before) / 1e6:.1f} MB)")
+        print(f"Jobs retained by JobManager: {router.job_manager.store.count()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
+import asyncio
+import json
 import os
-from fastapi import FastAPI, Request, HTTPException
+import threading
+import time
+from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from routers.image_generator_router import ImageGeneratorRouter
+from models.metrics import metrics, server_timing_header
 import uvicorn
 
 app = FastAPI(title="Image Generator API")
@@ -16,8 +22,36 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 # Set up static files
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
-# Create router instance
-image_generator_router = ImageGeneratorRouter()
+# The router (models, databases, job loop) is created on first use rather than at import,
+# so importing main stays cheap, e.g. in the parent process when uvicorn starts workers
+image_generator_router = None
+router_lock = threading.Lock()
+
+
+def get_router():
+    global image_generator_router
+    if image_generator_router is None:
+        with router_lock:
+            if image_generator_router is None:
+                image_generator_router = ImageGeneratorRouter()
+    return image_generator_router
+
+# Add Server-Timing headers to responses (set TIMING_HEADERS=0 to disable)
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "1") == "1"
+
+
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    seconds = time.perf_counter() - started
+    route = request.scope.get("route")
+    metrics.observe("http_request_duration_seconds", seconds, route=getattr(route, "path", "unmatched"))
+    if TIMING_HEADERS:
+        app_timing = server_timing_header({"app": seconds})
+        existing = response.headers.get("Server-Timing")
+        response.headers["Server-Timing"] = f"{existing}, {app_timing}" if existing else app_timing
+    return response
 
 
 @app.get("/")
@@ -26,29 +60,182 @@ async def index(request: Request):
 
 
 from fastapi import Body
-from typing import Dict
-
-@app.post("/api/generate_image")
-async def generate_image(user_input: str = Body(..., embed=True)):
-    response = image_generator_router.generate_image(user_input)
-    
-    # Check if the response contains an error
-    if isinstance(response, tuple) and len(response) == 2 and 'error' in response[0]:
+from typing import Dict, List, Optional
+
+def raise_for_error(response):
+    """Turn the router's ({'error': ...}, status) tuples into HTTP errors."""
+    if isinstance(response, tuple) and len(response) == 2 and isinstance(response[0], dict) and 'error' in response[0]:
         error_message = response[0]['error']
         status_code = response[1]
         raise HTTPException(status_code=status_code, detail=error_message)
-    
     return response
 
+@app.post("/api/generate_image", status_code=202)
+def generate_image(
+    user_input: str = Body(..., embed=True),
+    rounds: Optional[int] = Body(None, embed=True),
+    beam_width: Optional[int] = Body(None, embed=True),
+    beam_keep: Optional[int] = Body(None, embed=True),
+    concurrency: Optional[int] = Body(None, embed=True),
+    score_threshold: Optional[int] = Body(None, embed=True),
+    plateau_rounds: Optional[int] = Body(None, embed=True),
+    deadline_seconds: Optional[float] = Body(None, embed=True),
+    max_cost: Optional[float] = Body(None, embed=True),
+    warm_start: Optional[bool] = Body(None, embed=True),
+    aspect_ratio: Optional[str] = Body(None, embed=True),
+):
+    # Only queues the job; the refinement loop runs on the router's worker pool
+    return raise_for_error(get_router().generate_image(
+        user_input, rounds=rounds, beam_width=beam_width, beam_keep=beam_keep, concurrency=concurrency,
+        score_threshold=score_threshold, plateau_rounds=plateau_rounds,
+        deadline_seconds=deadline_seconds, max_cost=max_cost, warm_start=warm_start,
+        aspect_ratio=aspect_ratio
+    ))
+
+@app.post("/api/batches", status_code=202)
+def generate_batch(items: List[Dict] = Body(..., embed=True)):
+    """Queue many prompts at once. Each item takes user_input plus any /api/generate_image option."""
+    return raise_for_error(get_router().generate_batch(items))
+
+@app.get("/api/batches/{batch_id}")
+def get_batch(batch_id: str):
+    return raise_for_error(get_router().get_batch(batch_id))
+
+@app.get("/api/batches/{batch_id}/archive")
+def get_batch_archive(batch_id: str):
+    """Zip of the batch's finished images plus manifest.json."""
+    archive = raise_for_error(get_router().build_batch_archive(batch_id))
+
+    def chunks():
+        with archive:
+            while chunk := archive.read(64 * 1024):
+                yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=batch_{batch_id}.zip"}
+    )
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str, response: Response):
+    job = raise_for_error(get_router().get_job(job_id))
+    timings = (job.get("result") or {}).get("timings")
+    if TIMING_HEADERS and timings:
+        # Per-stage seconds of the finished job, summed over all candidates
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return job
+
+@app.post("/api/jobs/{job_id}/accept")
+def accept_job(job_id: str, follower_id: Optional[str] = None):
+    # The job finishes after its current round and returns the best image so far; if other clients
+    # share the job, only the caller leaves it, taking the best image so far with them
+    return raise_for_error(get_router().accept_job(job_id, follower_id))
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, follower_id: Optional[str] = None):
+    # Stops in-flight generations at once when the last client sharing the job cancels; earlier callers
+    # are only detached. Finished images stay logged
+    return raise_for_error(get_router().cancel_job(job_id, follower_id))
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-sent events: one 'round' event per evaluated round, then a 'done' event.
+
+    An open stream keeps the job alive; once the client disconnects and nothing else
+    follows the job, it is cancelled after JOB_ABANDON_SECONDS.
+    """
+    raise_for_error(await asyncio.to_thread(get_router().get_job, job_id))
+
+    # Each round event's id is its 1-based position, so a reconnecting EventSource resumes after the last one it got
+    try:
+        last_event_id = max(int(request.headers.get("last-event-id", "0")), 0)
+    except ValueError:
+        last_event_id = 0
+
+    async def event_stream():
+        seen_rounds = last_event_id
+        while not await request.is_disconnected():
+            job = await get_router().wait_for_job_update(job_id, seen_rounds)
+            if job is None:
+                return
+            for index, round_info in enumerate(job['progress']['rounds'][seen_rounds:], start=seen_rounds + 1):
+                yield f"id: {index}\nevent: round\ndata: {json.dumps(round_info, default=str)}\n\n"
+            seen_rounds = len(job['progress']['rounds'])
+            if job['status'] in ('completed', 'failed', 'cancelled'):
+                yield f"event: done\ndata: {json.dumps(job, default=str)}\n\n"
+                return
+            # Keep idle connections open through proxies
+            yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/get_images")
-async def get_images():
-    return image_generator_router.get_images()
+def get_images(cursor: Optional[str] = None, limit: int = 20):
+    return get_router().get_images(cursor, limit)
+
+# Saved images never change once written, so clients may cache them indefinitely
+IMAGE_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+@app.get("/api/images/{filename}")
+def get_image(filename: str, request: Request, format: Optional[str] = None,
+              quality: Optional[int] = None, max_dim: Optional[int] = None):
+    """Original bytes by default; format (jpeg/png/webp/auto), quality and max_dim request a cached variant.
+
+    quality snaps to the nearest of 50/70/80/85/95 and max_dim up to 128/256/512/1024/2048 (full size above).
+    """
+    filepath, content_type = raise_for_error(get_router().get_image_file(
+        filename, format, quality, max_dim, request.headers.get("accept", "")
+    ))
+    headers = dict(IMAGE_CACHE_HEADERS)
+    if format == "auto":
+        headers["Vary"] = "Accept"
+    return FileResponse(filepath, media_type=content_type, headers=headers)
+
+@app.get("/api/images/{filename}/thumbnail")
+def get_thumbnail(filename: str, request: Request):
+    filepath, content_type = raise_for_error(get_router().get_thumbnail_file(
+        filename, request.headers.get("accept", "")
+    ))
+    return FileResponse(filepath, media_type=content_type, headers=dict(IMAGE_CACHE_HEADERS, Vary="Accept"))
 
 @app.get("/api/get_csv_log")
-async def get_csv_log():
-    return image_generator_router.get_csv_log()
+def get_csv_log(user_prompt: Optional[str] = None, min_score: Optional[int] = None,
+                max_score: Optional[int] = None, since: Optional[str] = None,
+                until: Optional[str] = None, cursor: Optional[int] = None, limit: int = 100):
+    return get_router().get_csv_log(
+        user_prompt=user_prompt, min_score=min_score, max_score=max_score,
+        since=since, until=until, cursor=cursor, limit=limit
+    )
+
+@app.get("/api/export_csv_log")
+def export_csv_log():
+    return StreamingResponse(
+        get_router().export_csv_log(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=images_log.csv"}
+    )
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+def startup():
+    get_router()
+
+@app.on_event("shutdown")
+def shutdown():
+    if image_generator_router is not None:
+        image_generator_router.shutdown()
 
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Workers share state through the SQLite stores in IMAGES_DATA_DIR; reload only works with one
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=workers == 1, workers=workers)
\ No newline at end of file
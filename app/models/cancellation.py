@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+
+class GenerationCancelled(Exception):
+    """Raised when a job is cancelled before any candidate finished."""
+
+    def __init__(self, reason):
+        super().__init__(f"Generation stopped ({reason}) before any image was evaluated")
+        self.reason = reason
+
+
+class CancellationToken:
+    """Deadline and cancellation signal shared by one generation job and its candidates.
+
+    cancel() records why the job should stop; run() waits for a round's candidate
+    tasks and cancels the unfinished ones as soon as the token is cancelled or the
+    deadline passes, so no further fal or Gemini calls are made for the job.
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        # Reason reported when the deadline passes, so a job's own time cap can be told from the client's
+        self.deadline_reason = 'deadline'
+        self.reason = None
+        self.event = asyncio.Event()
+
+    def limit(self, timeout, reason='deadline'):
+        """Bring the deadline forward to timeout seconds from now, if that is sooner.
+
+        reason becomes the stop reason if this deadline is the one that passes.
+        """
+        if timeout:
+            deadline = time.monotonic() + timeout
+            if self.deadline is None or deadline < self.deadline:
+                self.deadline = deadline
+                self.deadline_reason = reason
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def cancel(self, reason='cancelled'):
+        if self.reason is None:
+            self.reason = reason
+            self.event.set()
+
+    @property
+    def cancelled(self):
+        if self.reason is None and self.deadline is not None and self.remaining() <= 0:
+            self.cancel(self.deadline_reason)
+        return self.reason is not None
+
+    async def run(self, tasks):
+        """Wait for tasks, cancelling any still running once the token fires or the deadline passes."""
+        watcher = asyncio.ensure_future(self.event.wait())
+        try:
+            pending = set(tasks)
+            while pending and not self.cancelled:
+                await asyncio.wait(pending | {watcher}, timeout=self.remaining(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                pending = {task for task in pending if not task.done()}
+        finally:
+            watcher.cancel()
+            for task in tasks:
+                task.cancel()
+            # Let cancelled candidates clean up (e.g. cancel their queued fal requests)
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,79 @@
+import math
+import os
+from dataclasses import dataclass, asdict
+
+from models.stopping_policy import IMAGE_COST, EVALUATION_COST, DRAFT_EVALUATION_COST
+
+MAX_ROUNDS = int(os.getenv('MAX_ROUNDS', '10'))
+MAX_BEAM_WIDTH = int(os.getenv('MAX_BEAM_WIDTH', '8'))
+MAX_CONCURRENCY = int(os.getenv('MAX_REQUEST_CONCURRENCY', '8'))
+# Aspect ratios accepted by Fal's Imagen 4 endpoint
+ASPECT_RATIOS = ("1:1", "16:9", "9:16", "3:4", "4:3")
+
+
+@dataclass
+class GenerationOptions:
+    """Per-request settings for the DSPy refinement loop.
+
+    beam_width is the number of candidates generated and evaluated per round;
+    beam_keep is how many of the best-scoring candidates seed the next round.
+    A beam width of 1 is the original sequential loop.
+
+    The loop stops early once the best overall_score reaches score_threshold, after
+    plateau_rounds rounds without improvement, or when another round would exceed
+    deadline_seconds or max_cost. Set score_threshold or plateau_rounds to 0 to disable them.
+
+    With warm_start, the first round uses the best-scoring prompt from a similar past
+    request instead of the raw template.
+
+    aspect_ratio is passed to the generator for every image in the loop.
+    """
+
+    rounds: int = 5
+    beam_width: int = 1
+    beam_keep: int = None
+    concurrency: int = None
+    score_threshold: int = int(os.getenv('DEFAULT_SCORE_THRESHOLD', '9'))
+    plateau_rounds: int = int(os.getenv('DEFAULT_PLATEAU_ROUNDS', '2'))
+    deadline_seconds: float = None
+    max_cost: float = None
+    warm_start: bool = True
+    aspect_ratio: str = "1:1"
+
+    def __post_init__(self):
+        if not 1 <= self.rounds <= MAX_ROUNDS:
+            raise ValueError(f"rounds must be between 1 and {MAX_ROUNDS}")
+        if not 1 <= self.beam_width <= MAX_BEAM_WIDTH:
+            raise ValueError(f"beam_width must be between 1 and {MAX_BEAM_WIDTH}")
+        if self.beam_keep is None:
+            self.beam_keep = math.ceil(self.beam_width / 2)
+        if not 1 <= self.beam_keep <= self.beam_width:
+            raise ValueError("beam_keep must be between 1 and beam_width")
+        if self.concurrency is None:
+            self.concurrency = min(self.beam_width, MAX_CONCURRENCY)
+        if not 1 <= self.concurrency <= MAX_CONCURRENCY:
+            raise ValueError(f"concurrency must be between 1 and {MAX_CONCURRENCY}")
+        if self.score_threshold == 0:
+            self.score_threshold = None
+        if self.score_threshold is not None and not 1 <= self.score_threshold <= 10:
+            raise ValueError("score_threshold must be between 1 and 10, or 0 to disable")
+        if self.plateau_rounds == 0:
+            self.plateau_rounds = None
+        if self.plateau_rounds is not None and self.plateau_rounds < 1:
+            raise ValueError("plateau_rounds must be positive, or 0 to disable")
+        if self.deadline_seconds is not None and self.deadline_seconds <= 0:
+            raise ValueError("deadline_seconds must be positive")
+        # The cheapest possible round is one image scored by the cheaper evaluator
+        min_cost = IMAGE_COST + min(EVALUATION_COST, DRAFT_EVALUATION_COST)
+        if self.max_cost is not None and self.max_cost < min_cost:
+            raise ValueError(f"max_cost must be at least {min_cost:g}, the cost of one image and its evaluation")
+        if self.aspect_ratio not in ASPECT_RATIOS:
+            raise ValueError(f"aspect_ratio must be one of: {', '.join(ASPECT_RATIOS)}")
+
+    @classmethod
+    def from_request(cls, **kwargs):
+        """Build options from request fields, ignoring the ones left unset."""
+        return cls(**{key: value for key, value in kwargs.items() if value is not None})
+
+    def to_dict(self):
+        return asdict(self)
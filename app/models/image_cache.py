@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from models.metrics import metrics
+
+
+class ImageCache:
+    """Content-addressed cache of raw image bytes.
+
+    Each URL is downloaded once, through the shared async HTTP client. Blobs are keyed by their SHA-256 digest and kept
+    in an in-memory LRU bounded by a byte budget; blobs evicted from memory spill
+    to disk so they can be reloaded without another download. The spill directory
+    is an LRU of its own, bounded by max_spill_bytes (per process; workers sharing
+    the directory each keep their own spills within it).
+    """
+
+    def __init__(self, cache_dir, http_client=None, max_bytes=None, max_urls=10000, max_spill_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+        if max_spill_bytes is None:
+            max_spill_bytes = int(os.getenv('IMAGE_CACHE_MAX_SPILL_BYTES', str(1024 * 1024 * 1024)))
+        self.cache_dir = cache_dir
+        self.http_client = http_client
+        self.max_bytes = max_bytes
+        self.max_urls = max_urls
+        self.max_spill_bytes = max_spill_bytes
+        self.blobs = OrderedDict()
+        self.urls = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.downloads = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Spilled blobs (digest -> size), least recently used first; picks up spills left by earlier runs
+        self.spilled = OrderedDict()
+        self.spilled_bytes = 0
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith('.tmp')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries:
+            self.spilled[entry.name] = entry.stat().st_size
+            self.spilled_bytes += entry.stat().st_size
+        self._trim_spill_locked()
+
+    async def fetch(self, url):
+        """Return (digest, bytes) for url, downloading it only on the first request."""
+        while True:
+            with self.lock:
+                digest = self.urls.get(url)
+                if digest is not None:
+                    self.urls.move_to_end(url)
+                    data = self._get_locked(digest)
+                    if data is not None:
+                        metrics.inc('image_cache_requests_total', outcome='hit')
+                        return digest, data
+                pending = self.downloads.get(url)
+                if pending is None:
+                    pending = asyncio.get_running_loop().create_future()
+                    self.downloads[url] = pending
+                    break
+            # Another task is already downloading this URL; wait for it and retry
+            await asyncio.shield(pending)
+
+        metrics.inc('image_cache_requests_total', outcome='miss')
+        try:
+            with metrics.span('image_download'):
+                response = await self.http_client.get(url)
+            digest = self.put_url(url, response.content)
+            return digest, response.content
+        finally:
+            with self.lock:
+                del self.downloads[url]
+            pending.set_result(None)
+
+    def lookup(self, url):
+        """Return cached bytes for url without downloading, or None."""
+        with self.lock:
+            digest = self.urls.get(url)
+            return self._get_locked(digest) if digest is not None else None
+
+    def put_url(self, url, data):
+        """Store bytes that were produced locally under url, so fetch(url) never downloads."""
+        digest = self.put(data)
+        with self.lock:
+            self.urls[url] = digest
+            self.urls.move_to_end(url)
+            while len(self.urls) > self.max_urls:
+                self.urls.popitem(last=False)
+        return digest
+
+    def put(self, data):
+        """Store bytes and return their digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if digest in self.blobs:
+                self.blobs.move_to_end(digest)
+                return digest
+            self.blobs[digest] = data
+            self.current_bytes += len(data)
+            self._evict_locked()
+        return digest
+
+    def get(self, digest):
+        """Return the bytes for digest from memory or disk, or None if unknown."""
+        with self.lock:
+            return self._get_locked(digest)
+
+    def _get_locked(self, digest):
+        data = self.blobs.get(digest)
+        if data is not None:
+            self.blobs.move_to_end(digest)
+            return data
+        path = self._spill_path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if digest in self.spilled:
+            self.spilled.move_to_end(digest)
+        self.blobs[digest] = data
+        self.current_bytes += len(data)
+        self._evict_locked(keep=digest)
+        return data
+
+    def _evict_locked(self, keep=None):
+        while self.current_bytes > self.max_bytes and len(self.blobs) > 1:
+            digest, data = next(iter(self.blobs.items()))
+            if digest == keep:
+                self.blobs.move_to_end(digest)
+                continue
+            del self.blobs[digest]
+            self.current_bytes -= len(data)
+            self._spill(digest, data)
+
+    def _spill(self, digest, data):
+        path = self._spill_path(digest)
+        if digest in self.spilled or os.path.exists(path):
+            # Already on disk (possibly reloaded from it); just mark it recently used
+            if digest in self.spilled:
+                self.spilled.move_to_end(digest)
+            return
+        if len(data) > self.max_spill_bytes:
+            return
+        try:
+            # Unique per process since several workers may spill the same blob
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Warning: Could not spill cached image to disk: {str(e)}")
+            return
+        self.spilled[digest] = len(data)
+        self.spilled_bytes += len(data)
+        self._trim_spill_locked()
+
+    def _trim_spill_locked(self):
+        """Delete the least recently used spilled blobs until the spill fits max_spill_bytes."""
+        while self.spilled_bytes > self.max_spill_bytes and self.spilled:
+            digest, size = self.spilled.popitem(last=False)
+            self.spilled_bytes -= size
+            try:
+                os.remove(self._spill_path(digest))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Warning: Could not remove spilled image: {str(e)}")
+
+    def _spill_path(self, digest):
+        return os.path.join(self.cache_dir, digest)
@@ -1,161 +1,303 @@
-import base64
-import requests
 from PIL import Image
 from io import BytesIO
+import asyncio
 import os
-import csv
+import threading
+import uuid
 from datetime import datetime
+from models.image_cache import ImageCache
+from models.log_store import LogStore
+from models.persistence_writer import PersistenceWriter
+from models.prompt_index import PromptIndex
+from models.metrics import metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+THUMBNAIL_SIZE = 256
+# Output formats for on-demand variants: name -> (PIL format, extension, content type)
+VARIANT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'png': ('PNG', '.png', 'image/png'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+# Requested sizes and qualities snap to these, so each image has a small fixed set of possible variants
+VARIANT_MAX_DIMS = (128, THUMBNAIL_SIZE, 512, 1024, 2048)
+VARIANT_QUALITIES = (50, 70, 80, 85, 95)
+# Longest side and JPEG quality of the copy sent to the evaluator; EVAL_IMAGE_MAX_DIM=0 sends originals
+EVAL_IMAGE_MAX_DIM = int(os.getenv('EVAL_IMAGE_MAX_DIM', '768'))
+EVAL_IMAGE_QUALITY = int(os.getenv('EVAL_IMAGE_QUALITY', '85'))
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+
+
+def sniff_content_type(data):
+    """Identify JPEG, PNG or WebP bytes from their signature."""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
 
 class ImageManager:
-    def __init__(self):
-        self.images = []
+    def __init__(self, http_client=None):
         # Set up the imagesdata directory
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.images_dir = os.path.join(self.base_dir, "imagesdata")
+        self.images_dir = os.getenv("IMAGES_DATA_DIR") or os.path.join(self.base_dir, "imagesdata")
         self.csv_file = os.path.join(self.images_dir, "images_log.csv")
         
         # Ensure the directory exists
         os.makedirs(self.images_dir, exist_ok=True)
+        self.image_cache = ImageCache(os.path.join(self.images_dir, "cache"), http_client=http_client)
+        self.variants_dir = os.path.join(self.images_dir, "variants")
+        os.makedirs(self.variants_dir, exist_ok=True)
         
-        # Initialize CSV file with headers if it doesn't exist
-        if not os.path.exists(self.csv_file):
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([
-                    'timestamp', 'image_id', 'original_user_prompt', 'prompt', 'image_url', 'local_filename', 'width', 'height',
-                    'subject_match', 'art_type_match', 'art_style_match', 'art_movement_match', 
-                    'overall_prompt_match', 'has_conflicting_elements',
-                    'subject_feedback', 'art_type_feedback', 'art_style_feedback', 'art_movement_feedback',
-                    'overall_feedback', 'conflict_description','overall_score'
-                ])
-        
-    def image_to_base64(self, image_data):
-        """Convert image data to base64. Handles both Google and Fal AI formats."""
-        try:
-            # Handle Fal AI format (URL-based)
-            if isinstance(image_data, dict) and "url" in image_data:
-                response = requests.get(image_data["url"])
-                response.raise_for_status()
-                image = Image.open(BytesIO(response.content))
-                buffered = BytesIO()
-                image.save(buffered, format="JPEG")
-                return base64.b64encode(buffered.getvalue()).decode("utf-8")
-            
-            else:
-                raise ValueError("Unsupported image data format")
-                
-        except Exception as e:
-            raise RuntimeError(f"Error processing image: {str(e)}")
+        # The evaluation log lives in SQLite; the legacy CSV is imported once on first start
+        self.log_store = LogStore(
+            os.path.join(self.images_dir, "images_log.db"),
+            legacy_csv_file=self.csv_file
+        )
+        # Similarity index over logged prompts, used to warm-start new refinement loops
+        self.prompt_index = PromptIndex.from_log_store(self.log_store)
+        # Image files and log rows are written by a background thread, off the request path
+        self.writer = PersistenceWriter(self.images_dir, self.log_store, on_logged=self._refresh_prompt_index)
+    
+    def _refresh_prompt_index(self, rows=None):
+        # Reads new rows from the shared log, so prompts scored by other workers are found too
+        self.prompt_index.refresh(self.log_store)
+    
+    def suggest_prompt(self, original_prompt):
+        """Best-scoring past prompt for a similar request, as (prompt, score, similarity), or None."""
+        self._refresh_prompt_index()
+        return self.prompt_index.suggest(original_prompt)
+    
+    def close(self):
+        """Write out everything still queued; call on shutdown."""
+        self.writer.close()
         
-    def add_image(self, prompt, image_data, dspy_result=None, original_user_prompt=None):
-        image_base64 = self.image_to_base64(image_data)
+    async def fetch_image(self, image_data):
+        """Return (digest, bytes) for an image, downloading it at most once."""
+        if isinstance(image_data, dict) and "url" in image_data:
+            return await self.image_cache.fetch(image_data["url"])
+        raise ValueError("Unsupported image data format")
+
+    async def prepare_for_evaluation(self, digest, content, max_dim=EVAL_IMAGE_MAX_DIM, quality=EVAL_IMAGE_QUALITY):
+        """Return (bytes, content_type) of a downscaled JPEG of content for the evaluator.
+
+        The copy is cached in the image cache under the original's digest, so an
+        image evaluated again (e.g. for the final decision) is not re-encoded.
+        """
+        if not max_dim:
+            return content, sniff_content_type(content)
+        key = f"evaluation://{digest}/{max_dim}/q{quality}"
+        data = self.image_cache.lookup(key)
+        if data is None:
+            data = await asyncio.to_thread(self._downscale, content, max_dim, quality)
+            self.image_cache.put_url(key, data)
+        return data, sniff_content_type(data)
+
+    @staticmethod
+    def _downscale(content, max_dim, quality):
+        with Image.open(BytesIO(content)) as image:
+            if max(image.size) <= max_dim and image.format == 'JPEG':
+                return content
+            image = image.convert("RGB")
+            image.thumbnail((max_dim, max_dim))
+            buffered = BytesIO()
+            image.save(buffered, format="JPEG", quality=quality)
+            return buffered.getvalue()
+
+    def add_image(self, prompt, image_data, dspy_result=None, original_user_prompt=None, content=None):
+        """Queue an already fetched image and its log row for saving, and return its entry.
+
+        The file and row are written shortly after by the background writer; the
+        returned URL already works since image lookups wait for pending writes.
+        """
+        # Keep the generator's original bytes; no decode or re-encode
+        if content is None:
+            content = self.image_cache.lookup(image_data.get("url"))
+        if content is None:
+            raise ValueError("Image must be fetched before it is added")
+        content_type = sniff_content_type(content)
         
         # Extract additional metadata from Fal AI response
-        metadata = {}
         image_url = ""
         width = height = None
         
         if isinstance(image_data, dict):
-            metadata = {
-                "url": image_data.get("url"),
-                "width": image_data.get("width"),
-                "height": image_data.get("height"),
-                "content_type": image_data.get("content_type")
-            }
             image_url = image_data.get("url", "")
             width = image_data.get("width")
             height = image_data.get("height")
         
-        # Generate unique image ID and filename
-        image_id = len(self.images)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"image_{timestamp}_{image_id}.jpg"
-        filepath = os.path.join(self.images_dir, filename)
-        
-        # Save image to file
-        try:
-            # Download and save the image
-            if image_url:
-                response = requests.get(image_url)
-                response.raise_for_status()
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-            else:
-                # Fallback: save from base64
-                image_bytes = base64.b64decode(image_base64)
-                with open(filepath, 'wb') as f:
-                    f.write(image_bytes)
-        except Exception as e:
-            print(f"Warning: Could not save image file: {str(e)}")
-            filename = ""  # Clear filename if save failed
+        # Unique across processes and restarts; the timestamp prefix keeps names in creation order
+        now = datetime.now()
+        image_id = f"{now.strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type, ".jpg")
+        filename = f"image_{image_id}{extension}"
         
-        # Extract DSPy evaluation data if provided
-        subject_match = dspy_result.subject_match if dspy_result else None
-        art_type_match = dspy_result.art_type_match if dspy_result else None
-        art_style_match = dspy_result.art_style_match if dspy_result else None
-        art_movement_match = dspy_result.art_movement_match if dspy_result else None
-        overall_prompt_match = dspy_result.overall_prompt_match if dspy_result else None
-        has_conflicting_elements = dspy_result.has_conflicting_elements if dspy_result else None
+        # Build the log row, including DSPy evaluation data if provided
+        row = {
+            'timestamp': now.isoformat(),
+            'image_id': image_id,
+            'original_user_prompt': original_user_prompt,
+            'prompt': prompt,
+            'image_url': image_url,
+            'local_filename': filename,
+            'width': width,
+            'height': height,
+        }
+        if dspy_result:
+            row.update(self._evaluation_fields(dspy_result))
+        self.writer.enqueue(filename, content, row)
         
-        subject_feedback = dspy_result.subject_feedback if dspy_result else None
-        art_type_feedback = dspy_result.art_type_feedback if dspy_result else None
-        art_style_feedback = dspy_result.art_style_feedback if dspy_result else None
-        art_movement_feedback = dspy_result.art_movement_feedback if dspy_result else None
-        overall_feedback = dspy_result.overall_prompt_match_feedback if dspy_result else None
-        conflict_description = dspy_result.conflict_description if dspy_result else None
-        overall_score = dspy_result.overall_score if dspy_result else None
-        # Log to CSV
+        return {
+            "id": image_id,
+            "prompt": prompt,
+            "local_filename": filename,
+            "url": f"/api/images/{filename}" if filename else image_url,
+            "content_type": content_type
+        }
+    
+    def log_evaluation(self, image_id, local_filename, prompt, dspy_result, original_user_prompt=None):
+        """Queue a log row re-scoring an image that was already added, such as a final main-model verdict.
+
+        The newest row for a file is the one the history shows.
+        """
+        row = {
+            'timestamp': datetime.now().isoformat(),
+            'image_id': image_id,
+            'original_user_prompt': original_user_prompt,
+            'prompt': prompt,
+            'local_filename': local_filename,
+        }
+        row.update(self._evaluation_fields(dspy_result))
+        self.writer.enqueue("", None, row)
+
+    @staticmethod
+    def _evaluation_fields(dspy_result):
+        return {
+            'subject_match': dspy_result.subject_match,
+            'art_type_match': dspy_result.art_type_match,
+            'art_style_match': dspy_result.art_style_match,
+            'art_movement_match': dspy_result.art_movement_match,
+            'overall_prompt_match': dspy_result.overall_prompt_match,
+            'has_conflicting_elements': dspy_result.has_conflicting_elements,
+            'subject_feedback': dspy_result.subject_feedback,
+            'art_type_feedback': dspy_result.art_type_feedback,
+            'art_style_feedback': dspy_result.art_style_feedback,
+            'art_movement_feedback': dspy_result.art_movement_feedback,
+            'overall_feedback': dspy_result.overall_prompt_match_feedback,
+            'conflict_description': dspy_result.conflict_description,
+            'overall_score': dspy_result.overall_score,
+        }
+
+    def get_images(self, cursor=None, limit=20):
+        """Return one page of saved images, newest first.
+
+        Pages come from the evaluation log's filename index, so each one costs the
+        same however many images are saved. Pass the returned next_cursor back in to
+        fetch the following page.
+        """
+        filenames, next_cursor = self.log_store.list_filenames(cursor, limit)
+        # Rows whose file failed to save or was removed are left out
+        page = [name for name in filenames if self.has_image(name)]
+        log_rows = self.log_store.find_by_filenames(page)
+        images = [
+            {
+                "id": os.path.splitext(name)[0],
+                "local_filename": name,
+                "url": f"/api/images/{name}",
+                "thumbnail_url": f"/api/images/{name}/thumbnail",
+                "prompt": log_rows.get(name, {}).get("prompt"),
+                "overall_score": log_rows.get(name, {}).get("overall_score"),
+            }
+            for name in page
+        ]
+        return {"images": images, "next_cursor": next_cursor}
+    
+    def has_image(self, filename):
+        """Whether filename is a saved image or one queued for writing. Never waits for the writer."""
+        if os.path.basename(filename) != filename or not filename.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        return self.writer.is_pending(filename) or os.path.isfile(os.path.join(self.images_dir, filename))
+
+    def get_image_path(self, filename):
+        """Return the path of a saved image, or None if the name is not a saved image.
+
+        Waits for the background writer if the file is still queued, so only call it
+        from a worker thread (a plain def endpoint), never from an event loop.
+        """
+        if os.path.basename(filename) != filename or not filename.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+        if self.writer.is_pending(filename):
+            self.writer.flush(timeout=10)
+        filepath = os.path.join(self.images_dir, filename)
+        return filepath if os.path.isfile(filepath) else None
+    
+    def get_image_content_type(self, filepath):
+        """Content type of a saved file, read from its bytes since older files may have the wrong extension."""
+        with open(filepath, 'rb') as f:
+            return sniff_content_type(f.read(16))
+    
+    @staticmethod
+    def snap_variant(quality, max_dim):
+        """Round quality to the nearest allowed value and max_dim up to the next allowed size.
+
+        Sizes beyond the largest allowed one mean the full-size image (None).
+        """
+        quality = min(VARIANT_QUALITIES, key=lambda allowed: (abs(allowed - quality), -allowed))
+        if max_dim is not None:
+            max_dim = next((allowed for allowed in VARIANT_MAX_DIMS if allowed >= max_dim), None)
+        return quality, max_dim
+
+    def get_variant_path(self, filename, image_format, quality=85, max_dim=None):
+        """Return (path, content_type) of a resized/re-encoded copy of a saved image.
+
+        quality and max_dim are snapped with snap_variant(). Each variant is rendered
+        once and kept in imagesdata/variants/.
+        """
+        filepath = self.get_image_path(filename)
+        if filepath is None:
+            return None, None
+        quality, max_dim = self.snap_variant(quality, max_dim)
+        pil_format, extension, content_type = VARIANT_FORMATS[image_format]
+        variant_name = f"{os.path.splitext(filename)[0]}_{max_dim or 'full'}_q{quality}{extension}"
+        variant_path = os.path.join(self.variants_dir, variant_name)
+        if os.path.exists(variant_path):
+            return variant_path, content_type
         try:
-            with open(self.csv_file, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([
-                    datetime.now().isoformat(),
-                    image_id,
-                    original_user_prompt,
-                    prompt,
-                    image_url,
-                    filename,
-                    width,
-                    height,
-                    subject_match,
-                    art_type_match,
-                    art_style_match,
-                    art_movement_match,
-                    overall_prompt_match,
-                    has_conflicting_elements,
-                    subject_feedback,
-                    art_type_feedback,
-                    art_style_feedback,
-                    art_movement_feedback,
-                    overall_feedback,
-                    conflict_description,
-                    overall_score
-                ])
+            with metrics.span('image_transcode'), Image.open(filepath) as image:
+                if pil_format == 'JPEG':
+                    image = image.convert("RGB")
+                if max_dim:
+                    image.thumbnail((max_dim, max_dim))
+                tmp_path = f"{variant_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                image.save(tmp_path, format=pil_format, quality=quality)
+            os.replace(tmp_path, variant_path)
         except Exception as e:
-            print(f"Warning: Could not write to CSV log: {str(e)}")
-        
-        image_entry = {
-            "id": image_id, 
-            "prompt": prompt, 
-            "image_base64": image_base64,
-            "metadata": metadata,
-            "local_filename": filename
-        }
-        self.images.append(image_entry)
-        return image_base64
+            print(f"Warning: Could not create image variant: {str(e)}")
+            return None, None
+        return variant_path, content_type
     
-    def get_images(self):
-        return self.images
+    def get_thumbnail_path(self, filename, image_format='jpeg'):
+        """Return (path, content_type) of a thumbnail for a saved image, creating it on first use."""
+        return self.get_variant_path(filename, image_format, quality=80, max_dim=THUMBNAIL_SIZE)
     
-    def get_csv_log(self):
-        """Read and return the CSV log data"""
-        if not os.path.exists(self.csv_file):
-            return []
-        
+    def get_csv_log(self, user_prompt=None, min_score=None, max_score=None, since=None, until=None,
+                    cursor=None, limit=100):
+        """Return one page of evaluation log rows, newest first, and the cursor for the next page"""
         try:
-            with open(self.csv_file, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                return list(reader)
+            return self.log_store.query(
+                user_prompt=user_prompt, min_score=min_score, max_score=max_score,
+                since=since, until=until, cursor=cursor, limit=limit
+            )
         except Exception as e:
-            print(f"Error reading CSV log: {str(e)}")
-            return []
\ No newline at end of file
+            print(f"Error reading evaluation log: {str(e)}")
+            return [], None
+    
+    def export_csv_log(self):
+        """Stream the evaluation log in the original CSV format"""
+        return self.log_store.iter_csv()
@@ -0,0 +1,290 @@
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from datetime import datetime
+
+from models.cancellation import CancellationToken, GenerationCancelled
+from models.job_store import JobStore, FINISHED
+from models.metrics import metrics
+
+# Stop reasons of jobs that ended because nobody wanted the result any more
+CANCEL_REASONS = ('cancelled', 'abandoned')
+
+
+class JobManager:
+    """Runs generation jobs as asyncio tasks and tracks their status in a shared JobStore.
+
+    Jobs run on one dedicated event loop thread; at most max_workers of them run at
+    once and the rest wait in line. Since generation I/O is async, concurrent jobs
+    cost no extra threads.
+
+    Job state lives in SQLite, so with several worker processes any of them can
+    report on, stop or join a job that another one is running.
+
+    Batches group jobs for aggregate progress. A job may also be submitted with its
+    own limit semaphore (one per batch), which it holds before taking a shared slot,
+    so a large batch cannot occupy every slot ahead of other requests.
+
+    Every job gets a CancellationToken with a max_seconds deadline. A watcher task
+    cancels the token when the job is cancelled through the store (from any worker)
+    or, for leased jobs, when no client has looked at it for abandon_seconds.
+    """
+
+    def __init__(self, db_file, max_workers=None, retention_seconds=None, poll_interval=0.5,
+                 max_seconds=None, abandon_seconds=None):
+        if max_workers is None:
+            max_workers = int(os.getenv('GENERATION_WORKERS', '32'))
+        if retention_seconds is None:
+            retention_seconds = int(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+        if max_seconds is None:
+            max_seconds = float(os.getenv('JOB_MAX_SECONDS', '900'))
+        if abandon_seconds is None:
+            abandon_seconds = float(os.getenv('JOB_ABANDON_SECONDS', '60'))
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.max_seconds = max_seconds
+        self.abandon_seconds = abandon_seconds
+        self.store = JobStore(db_file)
+        self.store.fail_orphans()
+        self.last_prune = 0
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name='generation-loop', daemon=True)
+        self.loop_thread.start()
+        self.slots = asyncio.Semaphore(max_workers)
+        # Tokens of this process's queued and running jobs; only touched on the loop thread
+        self.tokens = {}
+        self.watcher = asyncio.run_coroutine_threadsafe(self._watch(), self.loop)
+        # (loop, asyncio.Event) of waiters in wait_for_update(), set whenever a job of this
+        # process records a round or changes status
+        self.waiters = set()
+        self.waiters_lock = threading.Lock()
+
+    def submit(self, func, *args, key=None, limit=None, lease=True, follower=None, **kwargs):
+        """Queue func(*args, on_round=..., should_stop=..., cancel_token=..., **kwargs) and return (job_id, coalesced).
+
+        Jobs submitted with the same key while one is still queued or running, in
+        any worker, share that job instead of starting another (single-flight).
+        limit is an optional asyncio.Semaphore shared with related jobs. Jobs
+        without a lease are never cancelled as abandoned. on_round and should_stop
+        are coroutine functions. follower identifies the caller for request_stop()
+        and request_cancel() on a shared job.
+        """
+        self._prune()
+        job_id, coalesced = self.store.create(key, lease=lease, follower=follower)
+        if not coalesced:
+            asyncio.run_coroutine_threadsafe(self._run(job_id, func, args, kwargs, limit), self.loop)
+        return job_id, coalesced
+
+    def add_completed(self, result, key=None):
+        """Record a job whose result is already known (e.g. from a cache) and return its id."""
+        self._prune()
+        return self.store.create_completed(result, key)
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if it is unknown."""
+        return self.store.get(job_id)
+
+    def add_batch(self, items):
+        """Record a batch of submitted items (dicts with a job_id) and return its id."""
+        return self.store.add_batch(items)
+
+    def get_batch(self, batch_id):
+        """Return the batch with each item's job status and aggregate progress, or None if unknown."""
+        batch = self.store.get_batch(batch_id)
+        if batch is None:
+            return None
+        jobs = self.store.get_many({item['job_id'] for item in batch['items']})
+        counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        rounds_completed = 0
+        items = []
+        for item in batch['items']:
+            job = jobs.get(item['job_id'])
+            status = job['status'] if job is not None else 'expired'
+            counts[status] = counts.get(status, 0) + 1
+            result = (job or {}).get('result') or {}
+            if job is not None and item.get('duplicate_of') is None:
+                rounds_completed += sum(1 for round_info in job['progress']['rounds'] if not round_info.get('final'))
+            items.append(dict(
+                item,
+                status=status,
+                round=job['progress']['round'] if job is not None else None,
+                image_url=result.get('image_url'),
+                local_filename=result.get('local_filename'),
+                overall_score=result.get('overall_score'),
+                error=(job or {}).get('error'),
+            ))
+        finished = counts['queued'] == 0 and counts['running'] == 0
+        return {
+            'id': batch['id'],
+            'status': 'completed' if finished else 'running',
+            'created_at': batch['created_at'],
+            'progress': dict(counts, total=len(items), rounds_completed=rounds_completed),
+            'items': items,
+        }
+
+    async def wait_for_update(self, job_id, seen_rounds, timeout):
+        """Wait until the job has more than seen_rounds rounds or has finished, then return a snapshot.
+
+        Waits on the caller's event loop, so an open stream does not hold a thread;
+        only the store reads run in one. Jobs of this process wake the waiter
+        directly; jobs run by another worker are polled every poll_interval seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            # Registered before reading, so a change made in between still wakes us
+            waiter = (loop, asyncio.Event())
+            with self.waiters_lock:
+                self.waiters.add(waiter)
+            try:
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is None or job['status'] in FINISHED or len(job['progress']['rounds']) > seen_rounds:
+                    return job
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return job
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(waiter[1].wait(), min(remaining, self.poll_interval))
+            finally:
+                with self.waiters_lock:
+                    self.waiters.discard(waiter)
+
+    def request_stop(self, job_id, follower=None):
+        """Ask a job to finish after its current round, or detach follower if others share it.
+
+        Returns 'stopping', 'detached', 'shared' or None (already finished); see JobStore.request_stop.
+        """
+        return self.store.request_stop(job_id, follower)
+
+    def request_cancel(self, job_id, follower=None):
+        """Cancel a job now, keeping what it finished so far, or detach follower if others share it.
+
+        Returns 'cancelling', 'detached', 'shared' or None (already finished); see JobStore.request_cancel.
+        """
+        return self.store.request_cancel(job_id, follower)
+
+    def touch(self, job_id):
+        self.store.touch(job_id)
+
+    def in_flight(self):
+        return self.store.in_flight()
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the job loop from another thread and return its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def cancel_all(self, timeout=10):
+        """Cancel every queued and running job of this process and wait for them to unwind.
+
+        Their records stay in flight; once this process has exited, other workers fail them as orphans.
+        """
+        self.run(self._cancel_all(), timeout)
+
+    def shutdown(self, wait=True):
+        """Stop the job loop, after letting jobs finish (wait=True) or cancelling them."""
+        self.watcher.cancel()
+        if wait:
+            self.run(self._drain())
+        else:
+            self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+    async def _drain(self):
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _cancel_all(self):
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _run(self, job_id, func, args, kwargs, limit=None):
+        # Registered while still queued, so a job cancelled before it starts never runs
+        token = CancellationToken()
+        self.tokens[job_id] = token
+        try:
+            async with limit or contextlib.nullcontext():
+                async with self.slots:
+                    if token.cancelled:
+                        metrics.inc('jobs_total', status='cancelled')
+                        await self._update(job_id, status='cancelled', error=f"Job {token.reason} before it started",
+                                           finished_at=datetime.now().isoformat())
+                        return
+                    # Reported as 'job_timeout', unlike a deadline the client asked for
+                    token.limit(self.max_seconds, reason='job_timeout')
+                    await self._run_job(job_id, func, args, kwargs, token)
+        finally:
+            del self.tokens[job_id]
+
+    async def _watch(self):
+        """Cancel the tokens of jobs that were cancelled or abandoned, checking every poll_interval."""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self.tokens:
+                continue
+            abandoned_before = time.time() - self.abandon_seconds if self.abandon_seconds else None
+            try:
+                signals = await asyncio.to_thread(self.store.cancel_signals, list(self.tokens), abandoned_before)
+            except Exception as e:
+                print(f"Warning: Could not check for cancelled jobs: {str(e)}")
+                continue
+            for job_id, reason in signals.items():
+                token = self.tokens.get(job_id)
+                if token is not None and not token.cancelled:
+                    print(f"Job {job_id} {reason}; stopping it")
+                    token.cancel(reason)
+
+    async def _run_job(self, job_id, func, args, kwargs, token):
+        await self._update(job_id, status='running', started_at=datetime.now().isoformat())
+
+        # SQLite calls may wait on another worker's write lock, so they run off the job loop
+        async def on_round(round_info):
+            await asyncio.to_thread(self.store.append_round, job_id, round_info)
+            self._notify()
+
+        async def should_stop():
+            return await asyncio.to_thread(self.store.stop_requested, job_id)
+
+        try:
+            result = await func(*args, on_round=on_round, should_stop=should_stop, cancel_token=token, **kwargs)
+        except GenerationCancelled as e:
+            metrics.inc('jobs_total', status='cancelled')
+            await self._update(job_id, status='cancelled', error=str(e), finished_at=datetime.now().isoformat())
+        except Exception as e:
+            print(f"Job {job_id} failed: {str(e)}")
+            metrics.inc('jobs_total', status='failed')
+            await self._update(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+        else:
+            # A cancelled job still returns the best image it finished, but is reported as cancelled
+            status = 'cancelled' if result.get('stop_reason') in CANCEL_REASONS else 'completed'
+            metrics.inc('jobs_total', status=status)
+            await self._update(job_id, status=status, result=result, finished_at=datetime.now().isoformat())
+
+    async def _update(self, job_id, **fields):
+        await asyncio.to_thread(self.store.update, job_id, **fields)
+        self._notify()
+
+    def _notify(self):
+        with self.waiters_lock:
+            waiters = list(self.waiters)
+        for loop, event in waiters:
+            # The waiter's loop may have closed since it registered
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(event.set)
+
+    def _prune(self):
+        """Drop finished jobs older than the retention window, at most once a minute."""
+        now = time.monotonic()
+        if now - self.last_prune < 60:
+            return
+        self.last_prune = now
+        self.store.prune(self.retention_seconds)
@@ -0,0 +1,320 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+IN_FLIGHT = ('queued', 'running')
+FINISHED = ('completed', 'failed', 'cancelled')
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _parse_owner(owner):
+    """Split an owner token ("pid:instance", or a bare pid from older databases) into its pid."""
+    try:
+        return int(str(owner).split(':', 1)[0])
+    except ValueError:
+        return None
+
+
+class JobStore:
+    """Job and batch records in SQLite, shared by every worker process on the host.
+
+    Any worker can read a job's status and progress, ask it to stop, or join it by
+    key, whichever worker is running it. Each job records the pid of the worker that
+    runs it as "pid:instance", so jobs left behind by a worker that exited are marked
+    failed instead of blocking their key forever. The instance part tells a restarted
+    worker that was given the same pid (e.g. PID 1 in a container) from its predecessor.
+
+    Jobs submitted with a lease record when a client last looked at them (last_seen);
+    the job manager cancels those nobody has looked at for a while.
+
+    Everyone sharing a job (coalesced requests, batches) is recorded as a follower.
+    Cancelling or accepting a job that others still follow only detaches the caller;
+    the job is stopped once its last follower asks.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        self.lock = threading.Lock()
+        # Autocommit mode so transactions can take the write lock up front (BEGIN IMMEDIATE)
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, key TEXT, status TEXT, created_at TEXT, started_at TEXT, finished_at TEXT, "
+                "round INTEGER DEFAULT 0, rounds TEXT DEFAULT '[]', result TEXT, error TEXT, "
+                "stop_requested INTEGER DEFAULT 0, owner TEXT, updated_at REAL, "
+                "cancel_requested INTEGER DEFAULT 0, last_seen REAL)"
+            )
+            # Databases created before cancellation support lack the last two columns
+            columns = {record['name'] for record in self.conn.execute("PRAGMA table_info(jobs)")}
+            if 'cancel_requested' not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER DEFAULT 0")
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN last_seen REAL")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, created_at TEXT, items TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_followers (job_id TEXT, follower TEXT, PRIMARY KEY (job_id, follower))"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def create(self, key=None, lease=True, follower=None):
+        """Add a queued job owned by this process and return (job_id, coalesced).
+
+        If a job with the same key is still queued or running in a live worker, its
+        id is returned instead with coalesced=True. Joining without a lease (as
+        batches do) takes the lease off the shared job so it is never abandoned.
+        follower, if given, is recorded as following the job either way.
+        """
+        now = time.time()
+        with self._transaction():
+            if key is not None:
+                for record in self.conn.execute(
+                    "SELECT id, owner FROM jobs WHERE key = ? AND status IN (?, ?)", (key, *IN_FLIGHT)
+                ).fetchall():
+                    if self._owner_alive(record['owner']):
+                        self.conn.execute(
+                            "UPDATE jobs SET last_seen = ? WHERE id = ? AND last_seen IS NOT NULL",
+                            (now if lease else None, record['id'])
+                        )
+                        self._follow(record['id'], follower)
+                        return record['id'], True
+                    self._fail_orphan(record['id'])
+            job_id = uuid.uuid4().hex
+            self.conn.execute(
+                "INSERT INTO jobs (id, key, status, created_at, owner, updated_at, last_seen) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, key, datetime.now().isoformat(), self.owner, now, now if lease else None)
+            )
+            self._follow(job_id, follower)
+        return job_id, False
+
+    def create_completed(self, result, key=None):
+        """Add a job whose result is already known and return its id."""
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO jobs (id, key, status, created_at, started_at, finished_at, result, owner, updated_at) "
+                "VALUES (?, ?, 'completed', ?, ?, ?, ?, ?, ?)",
+                (job_id, key, now, now, now, json.dumps(result, default=str), self.owner, time.time())
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if it is unknown."""
+        with self.lock:
+            record = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(record) if record is not None else None
+
+    def get_many(self, job_ids):
+        """Return {job_id: job} for the known ids."""
+        if not job_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self.lock:
+            records = self.conn.execute(f"SELECT * FROM jobs WHERE id IN ({placeholders})", list(job_ids)).fetchall()
+        return {record['id']: self._to_dict(record) for record in records}
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], default=str)
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._transaction():
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def append_round(self, job_id, round_info):
+        with self._transaction():
+            record = self.conn.execute("SELECT round, rounds FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            rounds = json.loads(record['rounds'])
+            rounds.append(round_info)
+            self.conn.execute(
+                "UPDATE jobs SET round = ?, rounds = ?, updated_at = ? WHERE id = ?",
+                (round_info.get('round', record['round']), json.dumps(rounds, default=str), time.time(), job_id)
+            )
+
+    def request_stop(self, job_id, follower=None):
+        """Ask a queued or running job to stop after its current round, on behalf of follower.
+
+        Returns 'stopping', 'detached' if other followers remain (the caller stops
+        following, the job goes on), 'shared' if the caller is not one of the
+        followers and others remain, or None if the job already finished.
+        """
+        with self._transaction():
+            outcome = self._leave(job_id, follower)
+            if outcome == 'last':
+                self.conn.execute("UPDATE jobs SET stop_requested = 1 WHERE id = ?", (job_id,))
+                return 'stopping'
+        return outcome
+
+    def request_cancel(self, job_id, follower=None):
+        """Cancel a queued or running job on behalf of follower.
+
+        Returns 'cancelling', or 'detached', 'shared' or None as for request_stop().
+        """
+        with self._transaction():
+            outcome = self._leave(job_id, follower)
+            if outcome == 'last':
+                self.conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                return 'cancelling'
+        return outcome
+
+    def _follow(self, job_id, follower):
+        if follower is not None:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO job_followers (job_id, follower) VALUES (?, ?)", (job_id, follower)
+            )
+
+    def _leave(self, job_id, follower):
+        """Remove follower from an in-flight job; 'last' means nobody else follows it."""
+        record = self.conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if record is None or record['status'] not in IN_FLIGHT:
+            return None
+        followers = {
+            row['follower'] for row in
+            self.conn.execute("SELECT follower FROM job_followers WHERE job_id = ?", (job_id,))
+        }
+        if not followers - {follower}:
+            return 'last'
+        if follower not in followers:
+            return 'shared'
+        self.conn.execute("DELETE FROM job_followers WHERE job_id = ? AND follower = ?", (job_id, follower))
+        return 'detached'
+
+    def touch(self, job_id):
+        """Record that a client is still following the job (renews its lease)."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET last_seen = ? WHERE id = ? AND last_seen IS NOT NULL AND status IN (?, ?)",
+                (time.time(), job_id, *IN_FLIGHT)
+            )
+
+    def cancel_signals(self, job_ids, abandoned_before=None):
+        """Return {job_id: reason} for jobs that were cancelled, or whose lease expired before abandoned_before."""
+        if not job_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self.lock:
+            records = self.conn.execute(
+                f"SELECT id, cancel_requested, last_seen FROM jobs WHERE id IN ({placeholders})", list(job_ids)
+            ).fetchall()
+        signals = {}
+        for record in records:
+            if record['cancel_requested']:
+                signals[record['id']] = 'cancelled'
+            elif abandoned_before is not None and record['last_seen'] is not None \
+                    and record['last_seen'] < abandoned_before:
+                signals[record['id']] = 'abandoned'
+        return signals
+
+    def stop_requested(self, job_id):
+        with self.lock:
+            record = self.conn.execute("SELECT stop_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(record and record['stop_requested'])
+
+    def in_flight(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", IN_FLIGHT).fetchone()[0]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def fail_orphans(self):
+        """Mark in-flight jobs of workers that are no longer running as failed."""
+        with self._transaction():
+            for record in self.conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN (?, ?)", IN_FLIGHT
+            ).fetchall():
+                if not self._owner_alive(record['owner']):
+                    self._fail_orphan(record['id'])
+
+    def _owner_alive(self, owner):
+        if str(owner) == self.owner:
+            return True
+        pid = _parse_owner(owner)
+        # Our own pid under another token belongs to an earlier worker that has since exited
+        if pid is None or pid == os.getpid():
+            return False
+        return _process_alive(pid)
+
+    def _fail_orphan(self, job_id):
+        self.conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+            ("Worker process exited before the job finished", datetime.now().isoformat(), time.time(), job_id)
+        )
+
+    def add_batch(self, items):
+        batch_id = uuid.uuid4().hex
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO batches (id, created_at, items) VALUES (?, ?, ?)",
+                (batch_id, datetime.now().isoformat(), json.dumps(items))
+            )
+        return batch_id
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            record = self.conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if record is None:
+            return None
+        return {'id': record['id'], 'created_at': record['created_at'], 'items': json.loads(record['items'])}
+
+    def prune(self, retention_seconds):
+        """Drop finished jobs older than the retention window, and batches with none of their jobs left."""
+        cutoff = time.time() - retention_seconds
+        with self._transaction():
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?", (*FINISHED, cutoff)
+            )
+            self.conn.execute("DELETE FROM job_followers WHERE job_id NOT IN (SELECT id FROM jobs)")
+            for record in self.conn.execute("SELECT id, items FROM batches").fetchall():
+                job_ids = [item['job_id'] for item in json.loads(record['items'])]
+                placeholders = ", ".join("?" for _ in job_ids)
+                remaining = job_ids and self.conn.execute(
+                    f"SELECT COUNT(*) FROM jobs WHERE id IN ({placeholders})", job_ids
+                ).fetchone()[0]
+                if not remaining:
+                    self.conn.execute("DELETE FROM batches WHERE id = ?", (record['id'],))
+
+    @staticmethod
+    def _to_dict(record):
+        return {
+            'id': record['id'],
+            'status': record['status'],
+            'created_at': record['created_at'],
+            'started_at': record['started_at'],
+            'finished_at': record['finished_at'],
+            'progress': {'round': record['round'], 'rounds': json.loads(record['rounds'])},
+            'result': json.loads(record['result']) if record['result'] is not None else None,
+            'error': record['error'],
+        }
@@ -0,0 +1,213 @@
+import csv
+import io
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+LOG_COLUMNS = [
+    'timestamp', 'image_id', 'original_user_prompt', 'prompt', 'image_url', 'local_filename', 'width', 'height',
+    'subject_match', 'art_type_match', 'art_style_match', 'art_movement_match',
+    'overall_prompt_match', 'has_conflicting_elements',
+    'subject_feedback', 'art_type_feedback', 'art_style_feedback', 'art_movement_feedback',
+    'overall_feedback', 'conflict_description', 'overall_score'
+]
+
+INTEGER_COLUMNS = {'width', 'height', 'overall_score'}
+
+
+class LogStore:
+    """SQLite-backed evaluation log with the same columns as images_log.csv.
+
+    The database runs in WAL mode so readers never block the writer, and is indexed
+    by timestamp, original user prompt, local filename and score.
+    """
+
+    def __init__(self, db_file, legacy_csv_file=None):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        # Worker processes share the database; wait for each other's writes instead of failing
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        if legacy_csv_file and os.path.exists(legacy_csv_file):
+            self.import_csv(legacy_csv_file)
+
+    def _create_schema(self):
+        columns = ",\n".join(
+            f"{name} {'INTEGER' if name in INTEGER_COLUMNS else 'TEXT'}" for name in LOG_COLUMNS
+        )
+        with self.lock, self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS image_log (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_image_log_timestamp ON image_log (timestamp)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_image_log_user_prompt ON image_log (original_user_prompt)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_image_log_score ON image_log (overall_score)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_image_log_filename ON image_log (local_filename)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS imported_files (path TEXT PRIMARY KEY, imported_at TEXT)"
+            )
+
+    def import_csv(self, csv_file):
+        """Import an existing CSV log once. Returns the number of rows imported."""
+        source = os.path.abspath(csv_file)
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM imported_files WHERE path = ?", (source,)).fetchone():
+                return 0
+        try:
+            with open(csv_file, 'r', newline='', encoding='utf-8') as file:
+                records = [record for record in csv.reader(file) if record]
+        except Exception as e:
+            print(f"Error importing CSV log: {str(e)}")
+            return 0
+        # Logs written by older versions may have no header row; those use the LOG_COLUMNS order
+        fieldnames = LOG_COLUMNS
+        if records and 'timestamp' in records[0] and set(records[0]) <= set(LOG_COLUMNS):
+            fieldnames, records = records[0], records[1:]
+        rows = [self._normalize(dict(zip(fieldnames, record))) for record in records]
+        if not rows and os.path.getsize(csv_file) > 0 and fieldnames is LOG_COLUMNS:
+            # Leave it unmarked so a fixed import can still pick the history up
+            print(f"Warning: No rows could be read from CSV log {csv_file}")
+            return 0
+        with self.lock, self.conn:
+            # Check again under the write lock; another worker may have imported it meanwhile
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.conn.execute("SELECT 1 FROM imported_files WHERE path = ?", (source,)).fetchone():
+                return 0
+            self.conn.executemany(self._insert_sql(), [[row.get(name) for name in LOG_COLUMNS] for row in rows])
+            self.conn.execute(
+                "INSERT INTO imported_files (path, imported_at) VALUES (?, ?)",
+                (source, datetime.now().isoformat())
+            )
+        return len(rows)
+
+    def add(self, row):
+        """Append one log row given as a dict keyed by column name. Returns the stored row."""
+        row = self._normalize(row)
+        with self.lock, self.conn:
+            self.conn.execute(self._insert_sql(), [row.get(name) for name in LOG_COLUMNS])
+        return row
+
+    def add_many(self, rows):
+        """Append several log rows in one transaction. Returns the stored rows."""
+        rows = [self._normalize(row) for row in rows]
+        with self.lock, self.conn:
+            self.conn.executemany(self._insert_sql(), [[row.get(name) for name in LOG_COLUMNS] for row in rows])
+        return rows
+
+    def query(self, user_prompt=None, min_score=None, max_score=None, since=None, until=None,
+              cursor=None, limit=100):
+        """Return (rows, next_cursor), newest first, filtered by any of the given fields."""
+        clauses = []
+        params = []
+        if user_prompt is not None:
+            clauses.append("original_user_prompt = ?")
+            params.append(user_prompt)
+        if min_score is not None:
+            clauses.append("overall_score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            clauses.append("overall_score <= ?")
+            params.append(max_score)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT * FROM image_log {where} ORDER BY id DESC LIMIT ?"
+        with self.lock:
+            records = self.conn.execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = records[limit - 1]['id'] if len(records) > limit else None
+        return [self._to_dict(record) for record in records[:limit]], next_cursor
+
+    def find_by_filenames(self, filenames):
+        """Return {local_filename: row} for the given saved image filenames."""
+        if not filenames:
+            return {}
+        placeholders = ", ".join("?" for _ in filenames)
+        with self.lock:
+            records = self.conn.execute(
+                f"SELECT * FROM image_log WHERE local_filename IN ({placeholders}) ORDER BY id", list(filenames)
+            ).fetchall()
+        return {record['local_filename']: self._to_dict(record) for record in records}
+
+    def list_filenames(self, cursor=None, limit=20, prefix='image_'):
+        """Return (filenames, next_cursor): distinct logged filenames starting with prefix, newest name first.
+
+        Keyset-paged over the local_filename index; pass next_cursor back in for the following page.
+        """
+        # Every name with the prefix sorts below the prefix with its last character incremented
+        upper = cursor or prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self.lock:
+            records = self.conn.execute(
+                "SELECT DISTINCT local_filename FROM image_log WHERE local_filename >= ? AND local_filename < ? "
+                "ORDER BY local_filename DESC LIMIT ?",
+                (prefix, upper, limit + 1)
+            ).fetchall()
+        filenames = [record['local_filename'] for record in records]
+        next_cursor = filenames[limit - 1] if len(filenames) > limit else None
+        return filenames[:limit], next_cursor
+
+    def iter_scored_prompts(self, after_id=0, batch_size=1000):
+        """Yield (id, original_user_prompt, prompt, overall_score) for scored rows after after_id."""
+        while True:
+            with self.lock:
+                records = self.conn.execute(
+                    "SELECT id, original_user_prompt, prompt, overall_score FROM image_log "
+                    "WHERE id > ? AND overall_score IS NOT NULL ORDER BY id LIMIT ?",
+                    (after_id, batch_size)
+                ).fetchall()
+            for record in records:
+                yield record['id'], record['original_user_prompt'], record['prompt'], record['overall_score']
+            if len(records) < batch_size:
+                return
+            after_id = records[-1]['id']
+
+    def iter_csv(self, batch_size=500):
+        """Yield the whole log as CSV text in chunks, oldest first."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(LOG_COLUMNS)
+        last_id = 0
+        while True:
+            with self.lock:
+                records = self.conn.execute(
+                    "SELECT * FROM image_log WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            for record in records:
+                writer.writerow([record[name] for name in LOG_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(records) < batch_size:
+                return
+            last_id = records[-1]['id']
+
+    def _insert_sql(self):
+        placeholders = ", ".join("?" for _ in LOG_COLUMNS)
+        return f"INSERT INTO image_log ({', '.join(LOG_COLUMNS)}) VALUES ({placeholders})"
+
+    def _normalize(self, row):
+        normalized = {}
+        for name in LOG_COLUMNS:
+            value = row.get(name)
+            if value == '':
+                value = None
+            if value is not None and name in INTEGER_COLUMNS:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = None
+            elif value is not None and not isinstance(value, str):
+                value = str(value)
+            normalized[name] = value
+        return normalized
+
+    def _to_dict(self, record):
+        return {name: record[name] for name in LOG_COLUMNS}
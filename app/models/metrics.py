@@ -0,0 +1,146 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROUND_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+
+
+class Metrics:
+    """In-process counters, gauges and histograms rendered in Prometheus text format.
+
+    span() times a stage into the stage_duration_seconds histogram. Inside
+    collect(timings), spans in the same task or thread (including work handed to
+    asyncio.to_thread) also add their seconds to the given dict, which is how
+    per-request stage breakdowns are built.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.active_timings = ContextVar('active_timings', default=None)
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self.descriptions[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.descriptions.get(name, (None, None, DURATION_BUCKETS))[2] or DURATION_BUCKETS
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = histogram
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def register_gauge(self, name, callback, help_text):
+        """Report callback() as a gauge each time metrics are rendered."""
+        self.describe(name, 'gauge', help_text)
+        with self.lock:
+            self.gauges[name] = callback
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe('stage_duration_seconds', seconds, stage=stage)
+            timings = self.active_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0) + seconds
+
+    @contextmanager
+    def collect(self, timings):
+        """Add the seconds of every span in the current context to timings while the block runs."""
+        token = self.active_timings.set(timings)
+        try:
+            yield timings
+        finally:
+            self.active_timings.reset(token)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, counts=list(value['counts'])) for key, value in self.histograms.items()}
+            gauges = dict(self.gauges)
+
+        lines = []
+        described = set()
+
+        def header(name, fallback_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text, _ = self.descriptions.get(name, (fallback_type, name, None))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            header(name, 'histogram')
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        for name, callback in sorted(gauges.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"Warning: Could not read gauge {name}: {str(e)}")
+                continue
+            header(name, 'gauge')
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def server_timing_header(timings):
+    """Format a {stage: seconds} dict as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+metrics = Metrics()
+metrics.describe('stage_duration_seconds', 'histogram', "Time spent in each generation stage")
+metrics.describe('http_request_duration_seconds', 'histogram', "HTTP request handling time by route")
+metrics.describe('rounds_per_request', 'histogram', "Refinement rounds run per generation request", ROUND_BUCKETS)
+metrics.describe('generation_requests_total', 'counter', "Generation requests by outcome")
+metrics.describe('loop_stops_total', 'counter', "Refinement loops that ended, by stop reason")
+metrics.describe('early_stops_total', 'counter', "Refinement loops that ended before using all their rounds, by stop reason")
+metrics.describe('jobs_total', 'counter', "Finished generation jobs by status")
+metrics.describe('candidate_failures_total', 'counter', "Candidates that failed to generate or evaluate")
+metrics.describe('result_cache_requests_total', 'counter', "Result cache lookups by outcome")
+metrics.describe('image_cache_requests_total', 'counter', "Image cache fetches by outcome")
+metrics.describe('fal_cancellations_total', 'counter', "Fal requests cancelled after their job was abandoned")
+metrics.describe('evaluator_tokens_total', 'counter', "Evaluator prompt and completion tokens by model")
+metrics.describe('evaluation_duration_seconds', 'histogram', "Evaluator call latency by model")
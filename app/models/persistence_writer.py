@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+import time
+
+from models.metrics import metrics
+
+
+class PersistenceWriter:
+    """Background writer for saved images and their evaluation log rows.
+
+    enqueue() returns immediately; a single writer thread takes everything queued
+    so far (up to max_batch records), writes the image files, then inserts all of
+    their log rows in one SQLite transaction. Written files are fsynced together
+    every fsync_interval seconds rather than one by one. flush() waits until every
+    record queued before it is on disk.
+    """
+
+    def __init__(self, images_dir, log_store, on_logged=None, max_batch=64, fsync_interval=None):
+        if fsync_interval is None:
+            fsync_interval = float(os.getenv('PERSIST_FSYNC_INTERVAL', '1.0'))
+        self.images_dir = images_dir
+        self.log_store = log_store
+        self.on_logged = on_logged
+        self.max_batch = max_batch
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Filenames queued but not yet written, so readers know to flush first
+        self.pending = set()
+        self.unsynced = []
+        self.last_fsync = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name='persistence-writer', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, filename, content, row):
+        """Queue an image file (skipped if filename is empty) and its log row."""
+        if filename:
+            with self.lock:
+                self.pending.add(filename)
+        self.queue.put((filename, content, row))
+
+    def is_pending(self, filename):
+        with self.lock:
+            return filename in self.pending
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is written and fsynced. Returns False on timeout."""
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flush outstanding records and stop the writer thread."""
+        flushed = self.flush(timeout)
+        self.queue.put(None)
+        self.thread.join(timeout)
+        return flushed
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._sync()
+                continue
+            batch = [first]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [item for item in batch if isinstance(item, tuple)]
+            if records:
+                self._write(records)
+            flushes = [item for item in batch if isinstance(item, threading.Event)]
+            if flushes or time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self._sync()
+            for done in flushes:
+                done.set()
+            if any(item is None for item in batch):
+                return
+
+    def _write(self, records):
+        rows = []
+        for filename, content, row in records:
+            if filename:
+                try:
+                    with metrics.span('disk_write'):
+                        self._write_file(filename, content)
+                    self.unsynced.append(os.path.join(self.images_dir, filename))
+                except Exception as e:
+                    print(f"Warning: Could not save image file: {str(e)}")
+                    row = dict(row, local_filename="")
+            rows.append(row)
+
+        try:
+            with metrics.span('log_append'):
+                stored = self.log_store.add_many(rows)
+            if self.on_logged is not None:
+                self.on_logged(stored)
+        except Exception as e:
+            print(f"Warning: Could not write to evaluation log: {str(e)}")
+
+        # Cleared only once the log rows are in, so a reader that flushed for a file also finds its row
+        with self.lock:
+            for filename, _, _ in records:
+                self.pending.discard(filename)
+
+    def _write_file(self, filename, content):
+        filepath = os.path.join(self.images_dir, filename)
+        # Write under a temporary name so readers never see a partial file
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, filepath)
+
+    def _sync(self):
+        """fsync files written since the last sync, then the directory holding them."""
+        paths, self.unsynced = self.unsynced, []
+        self.last_fsync = time.monotonic()
+        if not paths:
+            return
+        try:
+            with metrics.span('fsync'):
+                for path in paths:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                fd = os.open(self.images_dir, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            print(f"Warning: Could not fsync saved images: {str(e)}")
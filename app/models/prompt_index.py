@@ -0,0 +1,111 @@
+import threading
+import zlib
+
+import numpy as np
+
+
+class PromptIndex:
+    """Local similarity index over logged user prompts.
+
+    Each distinct original user prompt is embedded as a TF-IDF weighted vector of
+    hashed character n-grams, and remembers the best-scoring prompt that was ever
+    used for it. suggest() returns that prompt for the most similar past request,
+    so a new refinement loop can start from something that already worked.
+
+    The raw vectors and their element-wise squares are kept in growing matrices,
+    so a query is two matrix-vector products and never copies the index: with
+    w = idf**2, cos(v, q) = (v . q*w) / sqrt((v**2 . w) * (q**2 . w)).
+    """
+
+    def __init__(self, dimensions=4096, ngram_size=3, min_similarity=0.6, min_score=8):
+        self.dimensions = dimensions
+        self.ngram_size = ngram_size
+        self.min_similarity = min_similarity
+        self.min_score = min_score
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.keys = {}
+        self.best_prompts = []
+        self.best_scores = []
+        self.vectors = np.zeros((64, dimensions), dtype=np.float32)
+        self.squares = np.zeros((64, dimensions), dtype=np.float32)
+        self.document_frequency = np.zeros(dimensions, dtype=np.float32)
+        self.last_row_id = 0
+
+    @classmethod
+    def from_log_store(cls, log_store, **kwargs):
+        index = cls(**kwargs)
+        index.refresh(log_store)
+        return index
+
+    def refresh(self, log_store):
+        """Add log rows written since the last refresh."""
+        with self.refresh_lock:
+            for row_id, original_prompt, prompt, score in log_store.iter_scored_prompts(after_id=self.last_row_id):
+                self.add(original_prompt, prompt, score)
+                self.last_row_id = max(self.last_row_id, row_id)
+
+    def add(self, original_prompt, prompt, score):
+        """Record that prompt scored score for original_prompt."""
+        if not original_prompt or not prompt or score is None:
+            return
+        with self.lock:
+            position = self.keys.get(original_prompt)
+            if position is not None:
+                if score > self.best_scores[position]:
+                    self.best_scores[position] = score
+                    self.best_prompts[position] = prompt
+                return
+            vector = self._vectorize(original_prompt)
+            position = len(self.best_prompts)
+            if position == len(self.vectors):
+                self.vectors = self._grow(self.vectors, position)
+                self.squares = self._grow(self.squares, position)
+            self.vectors[position] = vector
+            self.squares[position] = vector * vector
+            self.document_frequency += vector > 0
+            self.keys[original_prompt] = position
+            self.best_prompts.append(prompt)
+            self.best_scores.append(score)
+
+    def suggest(self, original_prompt):
+        """Return (prompt, score, similarity) for the best match, or None if nothing is close enough."""
+        with self.lock:
+            count = len(self.best_prompts)
+            if count == 0:
+                return None
+            idf = np.log((1 + count) / (1 + self.document_frequency)) + 1
+            weights = idf * idf
+            query = self._vectorize(original_prompt)
+            query_norm = np.sqrt(np.dot(query * query, weights))
+            if query_norm == 0:
+                return None
+            # Views of the first count rows; only count-sized results are allocated
+            norms = np.sqrt(self.squares[:count] @ weights)
+            norms[norms == 0] = 1
+            similarities = (self.vectors[:count] @ (query * weights)) / (norms * query_norm)
+            scores = np.asarray(self.best_scores)
+            similarities[scores < self.min_score] = -1
+            position = int(np.argmax(similarities))
+            similarity = float(similarities[position])
+            if similarity < self.min_similarity:
+                return None
+            return self.best_prompts[position], self.best_scores[position], similarity
+
+    def _grow(self, matrix, used):
+        grown = np.zeros((len(matrix) * 2, self.dimensions), dtype=np.float32)
+        grown[:used] = matrix[:used]
+        return grown
+
+    def _vectorize(self, text):
+        text = f" {' '.join(text.split()).casefold()} "
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for i in range(len(text) - self.ngram_size + 1):
+            bucket = zlib.crc32(text[i:i + self.ngram_size].encode('utf-8')) % self.dimensions
+            vector[bucket] += 1
+        # Sublinear term frequency so long prompts don't dominate
+        np.log1p(vector, out=vector)
+        return vector
+
+    def __len__(self):
+        return len(self.best_prompts)
@@ -1,3 +1,6 @@
+import hashlib
+
+
 class PromptManager:
     """Manages the loading and formatting of the prompt template for consistency."""
     
@@ -19,4 +22,14 @@ class PromptManager:
     def format_prompt(cls, user_input: str) -> str:
         """Format the prompt by inserting the user input into the template."""
         base_prompt = cls.load_base_prompt()
-        return base_prompt.format(user_input=user_input)
\ No newline at end of file
+        return base_prompt.format(user_input=user_input)
+
+    @classmethod
+    def normalize(cls, prompt: str) -> str:
+        """Normalize a formatted prompt for cache lookups (case and whitespace insensitive)."""
+        return " ".join(prompt.split()).casefold()
+
+    @classmethod
+    def template_version(cls) -> str:
+        """Short hash of the current template, so template edits invalidate cached results."""
+        return hashlib.sha256(cls.load_base_prompt().encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """Persistent cache of finished generation results with TTL and LRU eviction.
+
+    Entries live in a small SQLite database so they survive restarts. Values are
+    JSON-serializable result dicts; callers should keep large payloads (image bytes)
+    out of them and store references instead.
+    """
+
+    def __init__(self, db_file, ttl_seconds=None, max_entries=None):
+        if ttl_seconds is None:
+            ttl_seconds = int(os.getenv('RESULT_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+        if max_entries is None:
+            max_entries = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+
+    @staticmethod
+    def make_key(**parts):
+        """Stable hash of the JSON-serializable parts that determine a result."""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if created_at + self.ttl_seconds < now:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), now, now)
+            )
+            self.conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+            # Evict least recently used entries beyond the size limit
+            self.conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
@@ -0,0 +1,92 @@
+import math
+import os
+import time
+
+# Rough per-call prices used for the max_cost budget; override to match your billing
+IMAGE_COST = float(os.getenv('FAL_COST_PER_IMAGE', '0.04'))
+EVALUATION_COST = float(os.getenv('GEMINI_COST_PER_EVALUATION', '0.01'))
+DRAFT_EVALUATION_COST = float(os.getenv('GEMINI_DRAFT_COST_PER_EVALUATION', '0.0025'))
+
+
+class StoppingPolicy:
+    """Decides when the refinement loop should stop before using all of its rounds.
+
+    The loop asks before_round() whether another round fits the deadline and cost
+    budget and round_size() how many of its candidates max_cost still pays for, and
+    reports each finished round to after_round(), which stops once the best score
+    reaches the threshold or has not improved for plateau_rounds rounds.
+    """
+
+    def __init__(self, score_threshold=None, plateau_rounds=None, deadline_seconds=None, max_cost=None,
+                 image_cost=IMAGE_COST, evaluation_cost=EVALUATION_COST):
+        self.score_threshold = score_threshold
+        self.plateau_rounds = plateau_rounds
+        self.deadline_seconds = deadline_seconds
+        self.max_cost = max_cost
+        self.image_cost = image_cost
+        self.evaluation_cost = evaluation_cost
+        self.started = time.monotonic()
+        self.rounds = 0
+        self.cost = 0.0
+        self.best_score = None
+        self.rounds_without_improvement = 0
+
+    @classmethod
+    def from_options(cls, options, evaluation_cost=EVALUATION_COST):
+        return cls(
+            score_threshold=options.score_threshold,
+            plateau_rounds=options.plateau_rounds,
+            deadline_seconds=options.deadline_seconds,
+            max_cost=options.max_cost,
+            evaluation_cost=evaluation_cost,
+        )
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def before_round(self, candidates):
+        """Return a stop reason if not even one candidate of the next round fits the budgets.
+
+        Rounds that only partly fit max_cost are shrunk instead; see round_size().
+        """
+        if self.rounds > 0 and self.deadline_seconds is not None:
+            # Assume the next round takes as long as the average round so far
+            average_round = self.elapsed() / self.rounds
+            if self.elapsed() + average_round > self.deadline_seconds:
+                return 'deadline'
+        if self.round_size(candidates) == 0:
+            return 'max_cost'
+        return None
+
+    def round_size(self, candidates):
+        """How many of the next round's candidates fit in what is left of max_cost (at most candidates)."""
+        if self.max_cost is None:
+            return candidates
+        per_candidate = self.image_cost + self.evaluation_cost
+        # The small epsilon keeps float rounding from dropping a candidate that exactly fits
+        affordable = math.floor((self.max_cost - self.cost) / per_candidate + 1e-9)
+        return max(0, min(candidates, affordable))
+
+    def can_afford(self, amount):
+        """Whether spending amount more stays within max_cost."""
+        return self.max_cost is None or self.cost + amount <= self.max_cost
+
+    def add_cost(self, amount):
+        """Count spending outside the rounds, such as a final re-evaluation."""
+        self.cost += amount
+
+    def after_round(self, best_score, generations, evaluations):
+        """Record a finished round and return a stop reason, or None to keep going."""
+        self.rounds += 1
+        self.cost += generations * self.image_cost + evaluations * self.evaluation_cost
+        if self.best_score is None or best_score > self.best_score:
+            self.best_score = best_score
+            self.rounds_without_improvement = 0
+        else:
+            self.rounds_without_improvement += 1
+
+        if self.score_threshold is not None and self.best_score >= self.score_threshold:
+            return 'score_threshold'
+        if self.plateau_rounds is not None and self.rounds_without_improvement >= self.plateau_rounds:
+            return 'plateau'
+        return None
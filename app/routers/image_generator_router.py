@@ -1,25 +1,284 @@
 from services.dspy_optimization import ImageGeneratorService
-from models.image_manager import ImageManager
+from models.image_manager import ImageManager, VARIANT_FORMATS
+from models.job_manager import JobManager
+from models.generation_options import GenerationOptions
+from models.prompt_manager import PromptManager
+from models.result_cache import ResultCache
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+from models.metrics import metrics
+
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', '100'))
+# Loops that ended on their own terms; anything else (accepted, cancelled, abandoned, job_timeout,
+# failed) is cut short and must not be served to later identical requests. 'deadline' is only ever
+# the client's own deadline_seconds, which is part of the cache key.
+CACHEABLE_STOP_REASONS = ('all_match', 'score_threshold', 'plateau', 'max_rounds', 'max_cost', 'deadline')
 
 class ImageGeneratorRouter:
     def __init__(self):
         self.image_generator = ImageGeneratorService()
+        self.job_manager = JobManager(
+            os.path.join(self.image_generator.image_manager.images_dir, "jobs.db")
+        )
+        image_cache = self.image_generator.image_manager.image_cache
+        metrics.register_gauge('jobs_in_flight', self.job_manager.in_flight, "Queued or running generation jobs")
+        metrics.register_gauge('image_cache_bytes', lambda: image_cache.current_bytes, "Bytes held in the in-memory image cache")
+        metrics.register_gauge('image_cache_entries', lambda: len(image_cache.blobs), "Images held in the in-memory image cache")
+        self.result_cache = ResultCache(
+            os.path.join(self.image_generator.image_manager.images_dir, "result_cache.db")
+        )
+        # Job slots one batch may hold at once; the rest stay free for other requests
+        self.batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '4'))
     
-    def generate_image(self, user_input):
+    def generate_image(self, user_input, **options):
         if not user_input:
             return {'error': 'Missing input'}, 400
         try:
-            base64_image = self.image_generator.dspy_opt(user_input)
-            #base64_image = dspy_opt(user_input)
-            
-            return {'image': base64_image}
+            generation_options = GenerationOptions.from_request(**options)
+        except (TypeError, ValueError) as e:
+            return {'error': str(e)}, 400
+        try:
+            return self._submit(user_input, generation_options)
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    def generate_batch(self, items):
+        """Queue one job per item; identical items share a job. Returns the batch id."""
+        if not items:
+            return {'error': 'Missing items'}, 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return {'error': f"A batch may have at most {MAX_BATCH_ITEMS} items"}, 400
+        requests = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('user_input'):
+                return {'error': f"items[{index}]: missing user_input"}, 400
+            options = {key: value for key, value in item.items() if key != 'user_input'}
+            try:
+                requests.append((item['user_input'], GenerationOptions.from_request(**options)))
+            except (TypeError, ValueError) as e:
+                return {'error': f"items[{index}]: {str(e)}"}, 400
+        try:
+            limit = asyncio.Semaphore(self.batch_concurrency)
+            # The batch follows every job it shares, so no single client can cancel those jobs out from under it
+            follower = uuid.uuid4().hex
+            entries = []
+            first_index = {}
+            for index, (user_input, generation_options) in enumerate(requests):
+                key = self._cache_key(user_input, generation_options)
+                entry = {
+                    'index': index,
+                    'user_input': user_input,
+                    'aspect_ratio': generation_options.aspect_ratio,
+                    'duplicate_of': first_index.get(key),
+                }
+                if key in first_index:
+                    entry['job_id'] = entries[first_index[key]]['job_id']
+                else:
+                    first_index[key] = index
+                    # Batch results are collected later, so their jobs are never cancelled as abandoned
+                    submitted = self._submit(user_input, generation_options, key=key, limit=limit, lease=False,
+                                             follower=follower)
+                    entry.update(job_id=submitted['job_id'], cached=submitted['cached'],
+                                 coalesced=submitted.get('coalesced', False))
+                entries.append(entry)
+            batch_id = self.job_manager.add_batch(entries)
+            return {'batch_id': batch_id, 'status': 'queued', 'total': len(entries), 'unique': len(first_index)}
         except Exception as e:
             return {'error': str(e)}, 500
     
-    def get_images(self):
-        images = self.image_generator.get_all_images()
-        return {'images': images}
+    def _submit(self, user_input, generation_options, key=None, limit=None, lease=True, follower=None):
+        """Serve from the result cache or queue a job, coalescing with an identical job in flight.
+
+        Queued jobs get a follower_id that the caller passes to accept and cancel, so
+        leaving a shared job does not stop it for the others following it.
+        """
+        if key is None:
+            key = self._cache_key(user_input, generation_options)
+        cached = self._get_cached_result(key)
+        if cached is not None:
+            metrics.inc('result_cache_requests_total', outcome='hit')
+            metrics.inc('generation_requests_total', outcome='cached')
+            job_id = self.job_manager.add_completed(cached, key=key)
+            return {'job_id': job_id, 'status': 'completed', 'cached': True}
+        metrics.inc('result_cache_requests_total', outcome='miss')
+        follower = follower or uuid.uuid4().hex
+        # The manager keeps key= for coalescing; the job needs its own copy to store the result under
+        job_id, coalesced = self.job_manager.submit(
+            functools.partial(self._run_generation, key=key), user_input, generation_options,
+            key=key, limit=limit, lease=lease, follower=follower
+        )
+        metrics.inc('generation_requests_total', outcome='coalesced' if coalesced else 'queued')
+        return {'job_id': job_id, 'status': 'queued', 'cached': False, 'coalesced': coalesced,
+                'follower_id': follower}
+    
+    async def _run_generation(self, user_input, generation_options, key, on_round=None, should_stop=None,
+                              cancel_token=None):
+        result = await self.image_generator.dspy_opt(
+            user_input, generation_options, on_round=on_round, should_stop=should_stop, cancel_token=cancel_token
+        )
+        if result.get('local_filename') and result.get('stop_reason') in CACHEABLE_STOP_REASONS:
+            await asyncio.to_thread(self.result_cache.put, key, result)
+        return result
+    
+    def _cache_key(self, user_input, generation_options):
+        options = generation_options.to_dict()
+        # Concurrency changes how fast a result arrives, not what it is
+        options.pop('concurrency', None)
+        return ResultCache.make_key(
+            prompt=PromptManager.normalize(PromptManager.format_prompt(user_input)),
+            template=PromptManager.template_version(),
+            models=self.image_generator.model_settings(),
+            options=options,
+        )
+    
+    def _get_cached_result(self, key):
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+        if not self.image_generator.image_manager.has_image(cached['local_filename']):
+            # The image file was removed; regenerate rather than return a dead link
+            self.result_cache.delete(key)
+            return None
+        cached.setdefault('image_url', f"/api/images/{cached['local_filename']}")
+        return dict(cached, cached=True)
+    
+    def shutdown(self):
+        # Cancel jobs first, so their candidates can still cancel queued fal requests over the client
+        self.job_manager.cancel_all()
+        self.job_manager.run(self.image_generator.http_client.aclose())
+        self.job_manager.shutdown(wait=False)
+        self.image_generator.image_manager.close()
+    
+    def get_job(self, job_id):
+        # Polling a job keeps it from being cancelled as abandoned
+        self.job_manager.touch(job_id)
+        job = self.job_manager.get(job_id)
+        if job is None:
+            return {'error': 'Job not found'}, 404
+        return job
+    
+    def accept_job(self, job_id, follower_id=None):
+        """Stop the job after its current round, or, if others share it, leave with the best image so far."""
+        job = self.job_manager.get(job_id)
+        if job is None:
+            return {'error': 'Job not found'}, 404
+        if job['status'] not in ('queued', 'running'):
+            return {'error': 'Job already finished'}, 409
+        rounds = [round_info for round_info in job['progress']['rounds'] if round_info.get('image_url')]
+        if not rounds:
+            return {'error': 'No image to accept yet'}, 409
+        best = max(rounds, key=lambda round_info: round_info.get('overall_score') or 0)
+        return self._follower_response(job_id, self.job_manager.request_stop(job_id, follower_id), best)
+    
+    def cancel_job(self, job_id, follower_id=None):
+        """Cancel the job, or only detach the caller if other clients share it."""
+        if self.job_manager.get(job_id) is None:
+            return {'error': 'Job not found'}, 404
+        return self._follower_response(job_id, self.job_manager.request_cancel(job_id, follower_id))
+    
+    @staticmethod
+    def _follower_response(job_id, outcome, best=None):
+        if outcome is None:
+            return {'error': 'Job already finished'}, 409
+        if outcome == 'shared':
+            return {'error': 'Job is shared with other clients; pass your follower_id to leave it'}, 409
+        response = {'job_id': job_id, 'status': outcome}
+        if outcome == 'detached' and best is not None:
+            response['result'] = best
+        return response
+    
+    def get_batch(self, batch_id):
+        batch = self.job_manager.get_batch(batch_id)
+        if batch is None:
+            return {'error': 'Batch not found'}, 404
+        return batch
+    
+    def build_batch_archive(self, batch_id):
+        """Zip the finished images of a batch with a manifest.json; returns an open file positioned at 0.
+
+        Items still running are listed in the manifest without an image, so the
+        archive can be downloaded before the whole batch is done.
+        """
+        batch = self.job_manager.get_batch(batch_id)
+        if batch is None:
+            return {'error': 'Batch not found'}, 404
+        image_manager = self.image_generator.image_manager
+        archive = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+        manifest = []
+        # Images are already compressed, so store them as-is
+        with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_STORED) as zf:
+            written = set()
+            for item in batch['items']:
+                filename = item.get('local_filename')
+                filepath = image_manager.get_image_path(filename) if filename else None
+                if filepath is not None and filename not in written:
+                    zf.write(filepath, arcname=f"images/{filename}")
+                    written.add(filename)
+                manifest.append({
+                    'index': item['index'],
+                    'user_input': item['user_input'],
+                    'aspect_ratio': item['aspect_ratio'],
+                    'status': item['status'],
+                    'overall_score': item['overall_score'],
+                    'file': f"images/{filename}" if filepath is not None else None,
+                    'error': item['error'],
+                })
+            zf.writestr('manifest.json', json.dumps(manifest, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+        archive.seek(0)
+        return archive
+    
+    async def wait_for_job_update(self, job_id, seen_rounds, timeout=15):
+        await asyncio.to_thread(self.job_manager.touch, job_id)
+        return await self.job_manager.wait_for_update(job_id, seen_rounds, timeout)
+    
+    def get_images(self, cursor=None, limit=20):
+        limit = max(1, min(limit, 100))
+        return self.image_generator.get_all_images(cursor, limit)
+    
+    def get_image_file(self, filename, image_format=None, quality=None, max_dim=None, accept=''):
+        """Return (path, content_type) for an image, converting it only if a format or size was requested."""
+        image_manager = self.image_generator.image_manager
+        if image_format == 'auto':
+            image_format = self._negotiate_format(accept)
+        if image_format is None and quality is None and max_dim is None:
+            filepath = image_manager.get_image_path(filename)
+            if filepath is None:
+                return {'error': 'Image not found'}, 404
+            return filepath, image_manager.get_image_content_type(filepath)
+        if image_format is None:
+            image_format = 'jpeg'
+        if image_format not in VARIANT_FORMATS:
+            return {'error': f"format must be one of: auto, {', '.join(VARIANT_FORMATS)}"}, 400
+        if quality is not None and not 1 <= quality <= 95:
+            return {'error': 'quality must be between 1 and 95'}, 400
+        if max_dim is not None and not 16 <= max_dim <= 4096:
+            return {'error': 'max_dim must be between 16 and 4096'}, 400
+        filepath, content_type = image_manager.get_variant_path(filename, image_format, quality or 85, max_dim)
+        if filepath is None:
+            return {'error': 'Image not found'}, 404
+        return filepath, content_type
+    
+    def get_thumbnail_file(self, filename, accept=''):
+        filepath, content_type = self.image_generator.image_manager.get_thumbnail_path(
+            filename, self._negotiate_format(accept)
+        )
+        if filepath is None:
+            return {'error': 'Image not found'}, 404
+        return filepath, content_type
+    
+    @staticmethod
+    def _negotiate_format(accept):
+        return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+    
+    def get_csv_log(self, limit=100, **filters):
+        limit = max(1, min(limit, 1000))
+        csv_data, next_cursor = self.image_generator.get_csv_log(limit=limit, **filters)
+        return {'csv_data': csv_data, 'next_cursor': next_cursor}
     
-    def get_csv_log(self):
-        csv_data = self.image_generator.get_csv_log()
-        return {'csv_data': csv_data}
\ No newline at end of file
+    def export_csv_log(self):
+        return self.image_generator.export_csv_log()
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from models.metrics import metrics
+from services.fal_queue_client import FalQueueClient
+
+GENERATOR_MODEL = "fal-ai/imagen4/preview"
+
+
+class FalImageGenerator:
+    """Generates images with Fal AI's hosted Imagen 4 model."""
+
+    model = GENERATOR_MODEL
+
+    def __init__(self, http_client):
+        self.fal = FalQueueClient(http_client)
+
+    async def generate(self, prompt, aspect_ratio="1:1", seed=None):
+        """Return the Fal image dict (url, width, height, content_type) for prompt."""
+        arguments = {
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+        }
+        if seed is not None:
+            arguments["seed"] = seed
+        with metrics.span('fal_submit'):
+            handle = await self.fal.submit(self.model, arguments=arguments)
+
+        try:
+            with metrics.span('fal_queue_wait'):
+                await self.fal.wait(handle)
+                result = await self.fal.result(handle)
+        except asyncio.CancelledError:
+            # Nobody will read this image; free the queue slot if fal hasn't started it yet
+            cancelled = await asyncio.shield(self.fal.cancel(handle))
+            metrics.inc('fal_cancellations_total', outcome='cancelled' if cancelled else 'refused')
+            raise
+        return result["images"][0]
+
+
+class FakeImageGenerator:
+    """Offline stand-in for FalImageGenerator.
+
+    Produces a deterministic synthetic PNG per prompt after a configurable delay and
+    fails at a configurable rate. Images are placed straight into the image cache
+    under a fake:// URL, so the rest of the pipeline handles them like downloads.
+    """
+
+    model = "fake-generator"
+
+    def __init__(self, image_cache, latency=0.5, failure_rate=0.0, size=512, seed=0):
+        self.image_cache = image_cache
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.size = size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, image_cache):
+        return cls(
+            image_cache,
+            latency=float(os.getenv('FAKE_GENERATOR_LATENCY', '0.5')),
+            failure_rate=float(os.getenv('FAKE_GENERATOR_FAILURE_RATE', '0')),
+            size=int(os.getenv('FAKE_GENERATOR_SIZE', '512')),
+        )
+
+    async def generate(self, prompt, aspect_ratio="1:1", seed=None):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+            failed = self.random.random() < self.failure_rate
+        await asyncio.sleep(self.latency)
+        if failed:
+            raise RuntimeError("Fake generator failure")
+
+        width, height = self._dimensions(aspect_ratio)
+        # An explicit seed renders the same image every time, like a seeded fal request
+        variant = call if seed is None else f"seed{seed}"
+        content = await asyncio.to_thread(self._render, prompt, variant, width, height)
+        url = f"fake://{hashlib.sha256(content).hexdigest()}.png"
+        self.image_cache.put_url(url, content)
+        return {"url": url, "width": width, "height": height, "content_type": "image/png"}
+
+    def _dimensions(self, aspect_ratio):
+        """Fit aspect_ratio ("W:H") into a size x size box."""
+        ratio_width, ratio_height = (int(part) for part in aspect_ratio.split(':'))
+        if ratio_width >= ratio_height:
+            return self.size, self.size * ratio_height // ratio_width
+        return self.size * ratio_width // ratio_height, self.size
+
+    def _render(self, prompt, variant, width, height):
+        seed = hashlib.sha256(f"{prompt}:{variant}".encode('utf-8')).digest()
+        image = Image.new("RGB", (width, height), tuple(seed[:3]))
+        draw = ImageDraw.Draw(image)
+        step_x, step_y = width // 16, height // 16
+        for i in range(8):
+            draw.rectangle([i * step_x, i * step_y, width - i * step_x, height - i * step_y],
+                           outline=tuple(seed[3 + i * 3:6 + i * 3]), width=4)
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        return buffered.getvalue()
+
+
+class FakeImageEvaluator:
+    """Offline stand-in for the Gemini evaluator with scripted scores.
+
+    The score for an attempt is scores[attempt] (the last score repeats once the
+    script runs out). Attempts scoring at least match_score report every component
+    as matching, which ends the loop the same way a perfect real evaluation does.
+    """
+
+    model = "fake-evaluator"
+    draft_model = None
+
+    def __init__(self, scores=(6, 7, 8, 9, 10), latency=0.5, failure_rate=0.0, match_score=10, seed=0):
+        self.scores = list(scores)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.match_score = match_score
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        scores = os.getenv('FAKE_EVALUATOR_SCORES', '6,7,8,9,10')
+        return cls(
+            scores=[int(score) for score in scores.split(',')],
+            latency=float(os.getenv('FAKE_EVALUATOR_LATENCY', '0.5')),
+            failure_rate=float(os.getenv('FAKE_EVALUATOR_FAILURE_RATE', '0')),
+            match_score=int(os.getenv('FAKE_EVALUATOR_MATCH_SCORE', '10')),
+        )
+
+    async def evaluate(self, desired_prompt, image_bytes, content_type, current_prompt, previous_attempts, attempt=0,
+                       final=True):
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+        await asyncio.sleep(self.latency)
+        if failed:
+            raise RuntimeError("Fake evaluator failure")
+
+        score = self.scores[min(attempt, len(self.scores) - 1)]
+        matched = score >= self.match_score
+        feedback = f"Scripted evaluation for attempt {attempt + 1}"
+        result = SimpleNamespace(
+            reasoning=feedback,
+            overall_prompt_match=matched,
+            subject_match=matched,
+            art_type_match=matched,
+            art_style_match=matched,
+            art_movement_match=matched,
+            has_conflicting_elements=False,
+            conflict_description="None",
+            overall_prompt_match_feedback=feedback,
+            subject_feedback=feedback,
+            art_type_feedback=feedback,
+            art_style_feedback=feedback,
+            art_movement_feedback=feedback,
+            revised_prompt=f"{current_prompt}\n(revision {attempt + 1})",
+            overall_score=score,
+        )
+        usage = {'model': self.model, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': self.latency}
+        return result, usage
+
+
+def create_generator(image_cache, http_client):
+    """Pick the generator backend from IMAGE_BACKEND (fal or fake)."""
+    backend = os.getenv('IMAGE_BACKEND', 'fal')
+    if backend == 'fake':
+        return FakeImageGenerator.from_env(image_cache)
+    if backend == 'fal':
+        return FalImageGenerator(http_client)
+    raise ValueError(f"Unknown IMAGE_BACKEND: {backend}")
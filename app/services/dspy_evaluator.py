@@ -0,0 +1,84 @@
+import asyncio
+import base64
+import os
+import time
+from functools import partial
+
+import dspy
+
+EVALUATOR_MODEL = "gemini/gemini-2.5-pro"
+# Optional cheaper model (e.g. gemini/gemini-2.5-flash) for the rounds; EVALUATOR_MODEL then only makes the final call
+EVALUATOR_DRAFT_MODEL = os.getenv('EVALUATOR_DRAFT_MODEL') or None
+
+class ImageEvaluationSignature(dspy.Signature):
+    """Analyze a generated image against the desired prompt and provide detailed evaluation.
+    
+    Evaluate each component (subject, art type, art style, art movement) for accuracy.
+    Identify any conflicting elements that should not coexist. If conflicts exist, focus on the subject and art style first.
+    Provide specific, actionable feedback for improvements.
+    If issues are found, generate a revised prompt that addresses them precisely.
+    """
+    
+    desired_prompt: str = dspy.InputField(desc="The original prompt the user wanted")
+    current_image: dspy.Image = dspy.InputField(desc="The generated image to evaluate")
+    current_prompt: str = dspy.InputField(desc="The prompt used to generate this image")
+    previous_attempts: str = dspy.InputField(desc="History of previous attempts and feedback")
+    
+    reasoning: str = dspy.OutputField(desc="Step-by-step analysis of the image")
+    overall_prompt_match: bool = dspy.OutputField(desc="Does the image match the overall intent?")
+    subject_match: bool = dspy.OutputField(desc="Is the main subject correct?")
+    art_type_match: bool = dspy.OutputField(desc="Is the art type/medium correct?")
+    art_style_match: bool = dspy.OutputField(desc="Is the artistic style correct?")
+    art_movement_match: bool = dspy.OutputField(desc="Is the art movement/period correct?")
+    has_conflicting_elements: bool = dspy.OutputField(desc="Are there contradictory elements?")
+    
+    conflict_description: str = dspy.OutputField(desc="Describe any conflicting elements found")
+    overall_prompt_match_feedback: str = dspy.OutputField(desc="Feedback on overall match")
+    subject_feedback: str = dspy.OutputField(desc="Specific feedback on the subject")
+    art_type_feedback: str = dspy.OutputField(desc="Specific feedback on art type")
+    art_style_feedback: str = dspy.OutputField(desc="Specific feedback on art style")
+    art_movement_feedback: str = dspy.OutputField(desc="Specific feedback on art movement")
+    revised_prompt: str = dspy.OutputField(desc="Improved prompt addressing identified issues")
+    overall_score: int = dspy.OutputField(desc="Overall Score between 1 to 10 where 10 means perfect")
+class DspyImageEvaluator:
+    """Evaluates images with ImageEvaluationSignature on Gemini through DSPy.
+
+    With a draft_model, evaluations with final=False use it instead of the main model.
+    evaluate() returns (prediction, usage) where usage has the model, prompt and
+    completion tokens, and seconds taken.
+    """
+
+    model = EVALUATOR_MODEL
+
+    def __init__(self, draft_model=EVALUATOR_DRAFT_MODEL):
+        if not os.getenv('GEMINI_API_KEY'):
+            raise ValueError("GEMINI_API_KEY environment variable is required for LLM")
+        self.lm = dspy.LM(model=self.model,api_key=os.environ["GEMINI_API_KEY"])
+        self.draft_model = draft_model
+        self.draft_lm = dspy.LM(model=draft_model, api_key=os.environ["GEMINI_API_KEY"]) if draft_model else None
+        dspy.settings.configure(lm=self.lm, track_usage=True)
+
+    async def evaluate(self, desired_prompt, image_bytes, content_type, current_prompt, previous_attempts, attempt=0,
+                       final=True):
+        lm = self.lm if final or self.draft_lm is None else self.draft_lm
+        data_uri = f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+        check_and_revise_prompt = dspy.ChainOfThought(ImageEvaluationSignature)
+        # acall goes through litellm's async client; fall back to a worker thread on older DSPy
+        call = getattr(check_and_revise_prompt, 'acall', None)
+        if call is None:
+            call = partial(asyncio.to_thread, check_and_revise_prompt)
+        started = time.perf_counter()
+        with dspy.context(lm=lm):
+            result = await call(
+                desired_prompt=desired_prompt,
+                current_image=dspy.Image(url=data_uri),
+                current_prompt=current_prompt,
+                previous_attempts=previous_attempts
+            )
+        usage = {'model': lm.model, 'prompt_tokens': 0, 'completion_tokens': 0,
+                 'seconds': time.perf_counter() - started}
+        get_lm_usage = getattr(result, 'get_lm_usage', None)
+        for model_usage in ((get_lm_usage() if get_lm_usage else None) or {}).values():
+            usage['prompt_tokens'] += model_usage.get('prompt_tokens') or 0
+            usage['completion_tokens'] += model_usage.get('completion_tokens') or 0
+        return result, usage
@@ -1,125 +1,141 @@
-import dspy
+import asyncio
 import os
-from PIL import Image
-from io import BytesIO
-import requests
-import fal_client
+import random
 from dotenv import load_dotenv
-import base64
-import requests
 from models.image_manager import ImageManager
 from models.prompt_manager import PromptManager
+from models.generation_options import GenerationOptions
+from models.stopping_policy import StoppingPolicy, EVALUATION_COST, DRAFT_EVALUATION_COST
+from models.metrics import metrics
+from models.cancellation import CancellationToken, GenerationCancelled
+from services.backends import create_generator, FakeImageEvaluator
+from services.http_client import AsyncHttpClient
 load_dotenv()
 
-class ImageEvaluationSignature(dspy.Signature):
-    """Analyze a generated image against the desired prompt and provide detailed evaluation.
-    
-    Evaluate each component (subject, art type, art style, art movement) for accuracy.
-    Identify any conflicting elements that should not coexist. If conflicts exist, focus on the subject and art style first.
-    Provide specific, actionable feedback for improvements.
-    If issues are found, generate a revised prompt that addresses them precisely.
-    """
-    
-    desired_prompt: str = dspy.InputField(desc="The original prompt the user wanted")
-    current_image: dspy.Image = dspy.InputField(desc="The generated image to evaluate")
-    current_prompt: str = dspy.InputField(desc="The prompt used to generate this image")
-    previous_attempts: str = dspy.InputField(desc="History of previous attempts and feedback")
-    
-    reasoning: str = dspy.OutputField(desc="Step-by-step analysis of the image")
-    overall_prompt_match: bool = dspy.OutputField(desc="Does the image match the overall intent?")
-    subject_match: bool = dspy.OutputField(desc="Is the main subject correct?")
-    art_type_match: bool = dspy.OutputField(desc="Is the art type/medium correct?")
-    art_style_match: bool = dspy.OutputField(desc="Is the artistic style correct?")
-    art_movement_match: bool = dspy.OutputField(desc="Is the art movement/period correct?")
-    has_conflicting_elements: bool = dspy.OutputField(desc="Are there contradictory elements?")
-    
-    conflict_description: str = dspy.OutputField(desc="Describe any conflicting elements found")
-    overall_prompt_match_feedback: str = dspy.OutputField(desc="Feedback on overall match")
-    subject_feedback: str = dspy.OutputField(desc="Specific feedback on the subject")
-    art_type_feedback: str = dspy.OutputField(desc="Specific feedback on art type")
-    art_style_feedback: str = dspy.OutputField(desc="Specific feedback on art style")
-    art_movement_feedback: str = dspy.OutputField(desc="Specific feedback on art movement")
-    revised_prompt: str = dspy.OutputField(desc="Improved prompt addressing identified issues")
-    overall_score: int = dspy.OutputField(desc="Overall Score between 1 to 10 where 10 means perfect")
-class ImageGeneratorService:
-    def __init__(self):
-        self.image_manager = ImageManager()
-        if not os.getenv('GEMINI_API_KEY'):
-            raise ValueError("GEMINI_API_KEY environment variable is required for LLM")
-        if not os.getenv('FAL_KEY'):
-            raise ValueError("FAL_KEY environment variable is required for Fal AI")
-        
-        # Configure fal_client with API key
-        os.environ['FAL_KEY'] = os.getenv('FAL_KEY')
-        
-        lm = dspy.LM(model="gemini/gemini-2.5-pro",api_key=os.environ["GEMINI_API_KEY"])
-        dspy.settings.configure(lm=lm)
-
-    def generate_image(self, prompt):
-        request_id = fal_client.submit(
-            "fal-ai/imagen4/preview",
-            arguments={
-                "prompt": prompt
-            },
-        ).request_id
+def create_evaluator():
+    """Pick the evaluator backend from EVALUATOR_BACKEND (gemini or fake)."""
+    backend = os.getenv('EVALUATOR_BACKEND', 'gemini')
+    if backend == 'fake':
+        return FakeImageEvaluator.from_env()
+    if backend == 'gemini':
+        # dspy (and litellm behind it) is slow to import, so only load it when it is used
+        from services.dspy_evaluator import DspyImageEvaluator
+        return DspyImageEvaluator()
+    raise ValueError(f"Unknown EVALUATOR_BACKEND: {backend}")
 
-        result = fal_client.result("fal-ai/imagen4/preview", request_id)
-        url = result["images"][0]["url"]
-        # Don't call add_image here - return image_data for later logging
-        return dspy.Image.from_url(url), url, result["images"][0]
 
-    def dspy_opt(self, user_input):
+class ImageGeneratorService:
+    def __init__(self, generator=None, evaluator=None):
+        # One pooled async HTTP client for fal requests and image downloads
+        self.http_client = AsyncHttpClient()
+        self.image_manager = ImageManager(http_client=self.http_client)
+        self.generator = generator or create_generator(self.image_manager.image_cache, self.http_client)
+        self.evaluator = evaluator or create_evaluator()
+        # Global caps across all jobs, so batches and single requests share the model quotas
+        self.generator_slots = asyncio.Semaphore(int(os.getenv('GENERATOR_CONCURRENCY', '16')))
+        self.evaluator_slots = asyncio.Semaphore(int(os.getenv('EVALUATOR_CONCURRENCY', '16')))
+
+    async def dspy_opt(self, user_input, options=None, on_round=None, should_stop=None, cancel_token=None):
+        options = options or GenerationOptions()
+        # Cancelled by the job manager when the job is cancelled or abandoned; also enforces the deadline
+        token = cancel_token or CancellationToken()
+        token.limit(options.deadline_seconds)
         user_input = PromptManager.format_prompt(user_input)
         initial_prompt = user_input
-        current_prompt = initial_prompt
-
-        check_and_revise_prompt = dspy.ChainOfThought(ImageEvaluationSignature)
-
-        history = []
-
-        url = ''
-        
-        for i in range(5):
-            current_image, url, image_data = self.generate_image(current_prompt)
-            #display_image(current_image)
-            #print(f'current prompt: {current_prompt}')
-            # Format only the last attempt for context (more focused feedback)
-            if history:
-                last_attempt = history[-1]
-                history_str = (
-                    f"Previous attempt:\n"
-                    f"Prompt: {last_attempt['prompt']}\n"
-                    f"Subject: {last_attempt['detailed_feedback']['subject']}\n"
-                    f"Art Type: {last_attempt['detailed_feedback']['art_type']}\n"
-                    f"Style: {last_attempt['detailed_feedback']['style']}\n"
-                    f"Art Movement: {last_attempt['detailed_feedback']['art_movement']}\n"
-                    f"Conflicts: {last_attempt['detailed_feedback']['conflicts']}"
-                )
-            else:
-                history_str = "No previous attempts"
 
-            result = check_and_revise_prompt(
-                desired_prompt=initial_prompt, 
-                current_image=current_image, 
-                current_prompt=current_prompt,
-                previous_attempts=history_str
+        # Each beam entry is a prompt to try plus the attempt history that led to it
+        beam = [{'prompt': initial_prompt, 'history': []}]
+        warm_start_prompt = None
+        if options.warm_start:
+            # Refreshing the index reads the shared log, so keep it off the job loop
+            suggestion = await asyncio.to_thread(self.image_manager.suggest_prompt, initial_prompt)
+            if suggestion is not None:
+                warm_start_prompt, score, similarity = suggestion
+                print(f"Warm start from a past prompt (score {score}, similarity {similarity:.2f})")
+                beam = [{'prompt': warm_start_prompt, 'history': []}]
+                if options.beam_width > 1 and warm_start_prompt != initial_prompt:
+                    # Spend the other slots on the user's own prompt too, rather than copies of one prompt
+                    beam.append({'prompt': initial_prompt, 'history': []})
+        best = None
+        rounds = 0
+        stop_reason = 'max_rounds'
+        # Seconds spent per stage, summed over every candidate
+        timings = {}
+        # Evaluator calls, tokens and seconds per model
+        usage = {}
+        drafting = self.evaluator.draft_model is not None
+        policy = StoppingPolicy.from_options(
+            options, evaluation_cost=DRAFT_EVALUATION_COST if drafting else EVALUATION_COST
+        )
+
+        # Limits how many candidates of this request generate/evaluate at once
+        slots = asyncio.Semaphore(options.concurrency)
+
+        for i in range(options.rounds):
+            if token.cancelled:
+                stop_reason = token.reason
+                break
+            if best is not None and should_stop is not None and await should_stop():
+                # The client accepted an intermediate image
+                stop_reason = 'accepted'
+                break
+            reason = policy.before_round(options.beam_width)
+            if reason:
+                stop_reason = reason
+                break
+
+            # A round that only partly fits max_cost runs fewer candidates
+            prompts = self._round_entries(beam, policy.round_size(options.beam_width))
+            tasks = [
+                asyncio.create_task(self._run_candidate(
+                    initial_prompt, entry['prompt'], entry['history'], user_input, slots, options.aspect_ratio,
+                    entry['seed']
+                ))
+                for entry in prompts
+            ]
+            # Candidates still running when the token fires are cancelled; finished ones are kept
+            await token.run(tasks)
+            candidates = []
+            errors = []
+            for task in tasks:
+                if task.cancelled():
+                    continue
+                outcome = task.exception()
+                if isinstance(outcome, Exception):
+                    print(f"Warning: Candidate failed in round {i + 1}: {str(outcome)}")
+                    metrics.inc('candidate_failures_total')
+                    errors.append(outcome)
+                elif outcome is not None:
+                    raise outcome
+                else:
+                    candidates.append(task.result())
+            rounds = i + 1
+            for candidate in candidates:
+                for stage, seconds in candidate['timings'].items():
+                    timings[stage] = timings.get(stage, 0) + seconds
+                self._add_usage(usage, candidate['usage'])
+            if not candidates:
+                if token.cancelled:
+                    stop_reason = token.reason
+                    break
+                if best is None:
+                    raise errors[0]
+                stop_reason = 'failed'
+                break
+
+            candidates.sort(key=lambda candidate: self._score(candidate['result']), reverse=True)
+            if best is None or self._score(candidates[0]['result']) > self._score(best['result']):
+                best = candidates[0]
+            result = candidates[0]['result']
+            reason = policy.after_round(
+                self._score(result), generations=len(prompts), evaluations=len(candidates)
             )
-            
-            # Log image with DSPy evaluation data
-            self.image_manager.add_image(current_prompt, image_data, result, user_input)
-            # Store this attempt
-            history.append({
-                'prompt': current_prompt,
-                'detailed_feedback': {
-                'subject': result.subject_feedback,
-                'art_type': result.art_type_feedback,
-                'style': result.art_style_feedback,
-                'art_movement': result.art_movement_feedback,
-                'conflicts': result.conflict_description
-            }
-            })
-            
-            if result.subject_match and result.art_type_match and result.art_style_match and result.overall_prompt_match and not result.has_conflicting_elements and result.art_movement_match:
+            if on_round is not None:
+                await on_round(self._round_info(rounds, candidates, best))
+
+            matched = [candidate for candidate in candidates if self._all_match(candidate['result'])]
+            if matched:
+                result = matched[0]['result']
                 print("")
                 print("✓ All components match perfectly!")
                 print(f"Subject - {result.subject_feedback}")
@@ -129,32 +145,268 @@ class ImageGeneratorService:
                 print(f"Overall Prompt - {result.overall_prompt_match_feedback}")
                 print(f"Confliction:- {result.conflict_description}")
                 print(f"Confliction:- {result.overall_score}")
-                response = requests.get(url)
-                response.raise_for_status()
-                image = Image.open(BytesIO(response.content))
-                buffered = BytesIO()
-                image.save(buffered, format="JPEG")
-                return base64.b64encode(buffered.getvalue()).decode("utf-8")
+                best = matched[0]
+                stop_reason = 'all_match'
+                break
+
+            print(f"Subject Match: {'✓' if result.subject_match else '✗'} - {result.subject_feedback}")
+            print(f"Art Type Match: {'✓' if result.art_type_match else '✗'} - {result.art_type_feedback}")
+            print(f"Art Movement Match: {'✓' if result.art_movement_match else '✗'} - {result.art_movement_feedback}")
+            print(f"Art Style Match: {'✓' if result.art_style_match else '✗'} - {result.art_style_feedback}")
+            print(f"Overall Prompt Match: {'✓' if result.overall_prompt_match else '✗'} - {result.overall_prompt_match_feedback}")
+            print(f"Confliction: {'✓' if not result.has_conflicting_elements else '✗'} - {result.conflict_description}")
+            print(f"\nRevised prompt: {result.revised_prompt}")
+            print(f"Confliction: {result.overall_score}")
+
+            if token.cancelled:
+                print(f"Stopping early: {token.reason}")
+                stop_reason = token.reason
+                break
+            if reason:
+                print(f"Stopping early: {reason}")
+                stop_reason = reason
+                break
+
+            # The best-scoring candidates seed the next round with their revised prompts
+            beam = [
+                {'prompt': candidate['result'].revised_prompt, 'history': candidate['history']}
+                for candidate in candidates
+            ]
+            beam = self._distinct(beam)[:options.beam_keep]
+
+        if best is None:
+            raise GenerationCancelled(stop_reason)
+
+        if drafting and stop_reason != 'accepted' and not token.cancelled:
+            # Rounds were scored by the draft model; the main model makes the final call on the winner
+            # (skipped when the client already chose an image, or when it would break the cost budget)
+            if not policy.can_afford(EVALUATION_COST):
+                print("Skipping the final evaluation: it would exceed max_cost; keeping the draft score")
             else:
-                print(f"Subject Match: {'✓' if result.subject_match else '✗'} - {result.subject_feedback}")
-                print(f"Art Type Match: {'✓' if result.art_type_match else '✗'} - {result.art_type_feedback}")
-                print(f"Art Movement Match: {'✓' if result.art_movement_match else '✗'} - {result.art_movement_feedback}")
-                print(f"Art Style Match: {'✓' if result.art_style_match else '✗'} - {result.art_style_feedback}")
-                print(f"Overall Prompt Match: {'✓' if result.overall_prompt_match else '✗'} - {result.overall_prompt_match_feedback}")
-                print(f"Confliction: {'✓' if not result.has_conflicting_elements else '✗'} - {result.conflict_description}")
-                print(f"\nRevised prompt: {result.revised_prompt}")
-                print(f"Confliction: {result.overall_score}")
-                current_prompt = result.revised_prompt
-                
-        response = requests.get(url)
-        response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+                with metrics.collect(timings):
+                    final = asyncio.create_task(self._final_evaluation(best, initial_prompt))
+                await token.run([final])
+                # On failure the draft-scored candidate comes back unchanged
+                if not final.cancelled() and final.result() is not best:
+                    best = final.result()
+                    self._add_usage(usage, best['usage'])
+                    policy.add_cost(EVALUATION_COST)
+                    result = best['result']
+                    print(f"Final evaluation ({best['usage']['model']}): {result.overall_score}")
+                    self.image_manager.log_evaluation(
+                        best['image_id'], best['local_filename'], best['prompt'], result, user_input
+                    )
+                    if on_round is not None:
+                        await on_round(dict(self._round_info(rounds, [best], best), final=True))
+
+        # Return the best attempt seen in any round, not just the last one
+        return self._final_result(best, rounds, stop_reason, policy.cost, warm_start_prompt, timings, usage)
+
+    @staticmethod
+    def _distinct(beam):
+        """Beam entries with repeated prompts dropped, keeping the first (best) of each."""
+        distinct = {}
+        for entry in beam:
+            distinct.setdefault(entry['prompt'], entry)
+        return list(distinct.values())
+
+    @classmethod
+    def _round_entries(cls, beam, beam_width):
+        """Spread beam_width candidates over the distinct prompts in beam.
+
+        When there are fewer prompts than candidates, the copies of a prompt each get
+        their own explicit seed, so a round never generates the same request twice.
+        """
+        beam = cls._distinct(beam)
+        seed_base = random.randrange(2 ** 31 - beam_width)
+        entries = []
+        for j in range(beam_width):
+            entry = beam[j % len(beam)]
+            seed = seed_base + j if beam_width > len(beam) else None
+            entries.append(dict(entry, seed=seed))
+        return entries
+
+    async def _run_candidate(self, initial_prompt, current_prompt, history, user_input, slots, aspect_ratio="1:1",
+                             seed=None):
+        """Generate, evaluate and log one image for current_prompt."""
+        async with slots:
+            with metrics.collect({}) as timings:
+                return await self._run_candidate_stages(
+                    initial_prompt, current_prompt, history, user_input, timings, aspect_ratio, seed
+                )
+
+    async def _run_candidate_stages(self, initial_prompt, current_prompt, history, user_input, timings, aspect_ratio,
+                                    seed=None):
+        async with self.generator_slots:
+            with metrics.span('generate'):
+                image_data = await self.generator.generate(current_prompt, aspect_ratio=aspect_ratio, seed=seed)
+
+        with metrics.span('download'):
+            digest, content = await self.image_manager.fetch_image(image_data)
+
+        result, usage = await self._evaluate(initial_prompt, digest, content, current_prompt, history, final=False)
+
+        # Queue the image and its DSPy evaluation for the background writer
+        with metrics.span('persist'):
+            image_entry = self.image_manager.add_image(
+                current_prompt, image_data, result, user_input, content=content
+            )
+        attempt = {
+            'prompt': current_prompt,
+            'detailed_feedback': {
+                'subject': result.subject_feedback,
+                'art_type': result.art_type_feedback,
+                'style': result.art_style_feedback,
+                'art_movement': result.art_movement_feedback,
+                'conflicts': result.conflict_description
+            }
+        }
+        return {
+            'prompt': current_prompt,
+            'seed': seed,
+            'result': result,
+            'usage': usage,
+            'digest': digest,
+            'image_id': image_entry['id'],
+            'image_url': image_entry['url'],
+            'content_type': image_entry['content_type'],
+            'local_filename': image_entry['local_filename'],
+            'history': history + [attempt],
+            'timings': dict(timings),
+        }
+
+    async def _evaluate(self, initial_prompt, digest, content, current_prompt, history, final):
+        """Evaluate a downscaled copy of the image and return (result, usage)."""
+        with metrics.span('eval_preprocess'):
+            image_bytes, content_type = await self.image_manager.prepare_for_evaluation(digest, content)
+
+        async with self.evaluator_slots:
+            with metrics.span('evaluate'):
+                result, usage = await self.evaluator.evaluate(
+                    desired_prompt=initial_prompt,
+                    image_bytes=image_bytes,
+                    content_type=content_type,
+                    current_prompt=current_prompt,
+                    previous_attempts=self._format_history(history),
+                    attempt=len(history),
+                    final=final
+                )
+        metrics.observe('evaluation_duration_seconds', usage['seconds'], model=usage['model'])
+        metrics.inc('evaluator_tokens_total', usage['prompt_tokens'], model=usage['model'], kind='prompt')
+        metrics.inc('evaluator_tokens_total', usage['completion_tokens'], model=usage['model'], kind='completion')
+        return result, usage
+
+    async def _final_evaluation(self, candidate, initial_prompt):
+        """Re-score candidate with the main evaluator model; keeps the draft verdict if that fails."""
+        content = self.image_manager.image_cache.get(candidate['digest'])
+        try:
+            if content is None:
+                raise ValueError("Image is no longer cached")
+            result, usage = await self._evaluate(
+                initial_prompt, candidate['digest'], content, candidate['prompt'], candidate['history'][:-1],
+                final=True
+            )
+        except Exception as e:
+            print(f"Warning: Final evaluation failed, keeping the draft score: {str(e)}")
+            return candidate
+        return dict(candidate, result=result, usage=usage)
+
+    @staticmethod
+    def _round_info(rounds, candidates, best):
+        """Progress entry for a round; candidates are sorted best first."""
+        result = candidates[0]['result']
+        local_filename = candidates[0]['local_filename']
+        return {
+            'round': rounds,
+            'prompt': candidates[0]['prompt'],
+            'image_url': f"/api/images/{local_filename}" if local_filename else None,
+            'thumbnail_url': f"/api/images/{local_filename}/thumbnail" if local_filename else None,
+            'overall_score': result.overall_score,
+            'overall_feedback': result.overall_prompt_match_feedback,
+            'feedback': {
+                'subject': result.subject_feedback,
+                'art_type': result.art_type_feedback,
+                'art_style': result.art_style_feedback,
+                'art_movement': result.art_movement_feedback,
+                'conflicts': result.conflict_description,
+            },
+            'candidate_scores': [candidate['result'].overall_score for candidate in candidates],
+            'best_score': best['result'].overall_score,
+            'evaluator_model': candidates[0]['usage']['model'],
+        }
+
+    @staticmethod
+    def _format_history(history):
+        # Format only the last attempt for context (more focused feedback)
+        if not history:
+            return "No previous attempts"
+        last_attempt = history[-1]
+        return (
+            f"Previous attempt:\n"
+            f"Prompt: {last_attempt['prompt']}\n"
+            f"Subject: {last_attempt['detailed_feedback']['subject']}\n"
+            f"Art Type: {last_attempt['detailed_feedback']['art_type']}\n"
+            f"Style: {last_attempt['detailed_feedback']['style']}\n"
+            f"Art Movement: {last_attempt['detailed_feedback']['art_movement']}\n"
+            f"Conflicts: {last_attempt['detailed_feedback']['conflicts']}"
+        )
+
+    @staticmethod
+    def _add_usage(totals, usage):
+        model_totals = totals.setdefault(
+            usage['model'], {'evaluations': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0}
+        )
+        model_totals['evaluations'] += 1
+        model_totals['prompt_tokens'] += usage['prompt_tokens']
+        model_totals['completion_tokens'] += usage['completion_tokens']
+        model_totals['seconds'] += usage['seconds']
+
+    def _final_result(self, candidate, rounds, stop_reason, cost=None, warm_start_prompt=None, timings=None,
+                      usage=None):
+        metrics.observe('rounds_per_request', rounds)
+        metrics.inc('loop_stops_total', reason=stop_reason)
+        if stop_reason != 'max_rounds':
+            metrics.inc('early_stops_total', reason=stop_reason)
+        return {
+            'image_url': candidate['image_url'],
+            'content_type': candidate['content_type'],
+            'local_filename': candidate['local_filename'],
+            'prompt': candidate['prompt'],
+            'seed': candidate.get('seed'),
+            'overall_score': candidate['result'].overall_score,
+            'rounds': rounds,
+            'stop_reason': stop_reason,
+            'estimated_cost': cost,
+            'warm_start_prompt': warm_start_prompt,
+            'timings': timings or {},
+            'evaluator_usage': usage or {},
+        }
+
+    @staticmethod
+    def _all_match(result):
+        return (result.subject_match and result.art_type_match and result.art_style_match
+                and result.overall_prompt_match and not result.has_conflicting_elements
+                and result.art_movement_match)
+
+    @staticmethod
+    def _score(result):
+        try:
+            return int(result.overall_score)
+        except (TypeError, ValueError):
+            return 0
+    
+    def model_settings(self):
+        """Models used by dspy_opt; part of the result cache key."""
+        settings = {'generator': self.generator.model, 'evaluator': self.evaluator.model}
+        if self.evaluator.draft_model is not None:
+            settings['evaluator_draft'] = self.evaluator.draft_model
+        return settings
+
+    def get_all_images(self, cursor=None, limit=20):
+        return self.image_manager.get_images(cursor, limit)
     
-    def get_all_images(self):
-        return self.image_manager.get_images()
+    def get_csv_log(self, **filters):
+        return self.image_manager.get_csv_log(**filters)
     
-    def get_csv_log(self):
-        return self.image_manager.get_csv_log()
\ No newline at end of file
+    def export_csv_log(self):
+        return self.image_manager.export_csv_log()
\ No newline at end of file
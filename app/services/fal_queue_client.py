@@ -0,0 +1,60 @@
+import asyncio
+import os
+
+FAL_QUEUE_URL = "https://queue.fal.run"
+
+
+class FalQueueClient:
+    """Async client for the Fal AI queue API on the shared pooled HTTP client.
+
+    Implements the same submit / poll status / fetch result protocol as
+    fal_client.submit and fal_client.result, without a thread per request.
+    """
+
+    def __init__(self, http_client, key=None, poll_interval=0.5, max_poll_interval=2.0):
+        self.http_client = http_client
+        self.key = key or os.getenv('FAL_KEY')
+        if not self.key:
+            raise ValueError("FAL_KEY environment variable is required for Fal AI")
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def _headers(self):
+        return {"Authorization": f"Key {self.key}"}
+
+    async def submit(self, model, arguments):
+        """Queue a request and return its handle (request_id, status_url, response_url, cancel_url)."""
+        response = await self.http_client.post(f"{FAL_QUEUE_URL}/{model}", json=arguments, headers=self._headers())
+        return response.json()
+
+    async def wait(self, handle):
+        """Poll until the queued request completes."""
+        interval = self.poll_interval
+        while True:
+            response = await self.http_client.get(handle["status_url"], headers=self._headers())
+            status = response.json().get("status")
+            if status == "COMPLETED":
+                return
+            if status not in ("IN_QUEUE", "IN_PROGRESS"):
+                raise RuntimeError(f"Fal request {handle['request_id']} ended with status {status}")
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, self.max_poll_interval)
+
+    async def result(self, handle):
+        response = await self.http_client.get(handle["response_url"], headers=self._headers())
+        return response.json()
+
+    async def cancel(self, handle):
+        """Cancel a request that is still queued. Returns False if Fal refused (e.g. already running)."""
+        try:
+            await self.http_client.put(handle["cancel_url"], headers=self._headers())
+            return True
+        except Exception as e:
+            print(f"Warning: Could not cancel Fal request {handle.get('request_id')}: {str(e)}")
+            return False
+
+    async def run(self, model, arguments):
+        """Submit, wait and return the result in one call."""
+        handle = await self.submit(model, arguments)
+        await self.wait(handle)
+        return await self.result(handle)
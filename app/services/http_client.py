@@ -0,0 +1,103 @@
+import asyncio
+import os
+import random
+from urllib.parse import urlsplit
+
+import httpx
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# A POST may have reached the server unless the connection never opened, or it was rejected outright
+POST_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+POST_RETRY_STATUS_CODES = {429}
+
+
+class AsyncHttpClient:
+    """Shared asyncio HTTP client for fal and image downloads.
+
+    One pooled httpx.AsyncClient keeps TLS connections alive across requests. Each
+    host gets its own concurrency limit, every request has a timeout, and
+    connection errors, timeouts and retryable status codes are retried with
+    exponential backoff and jitter. Non-idempotent requests (the fal submit POST)
+    are only retried when they cannot have been processed, so a job is never queued
+    or billed twice.
+    """
+
+    def __init__(self, max_connections=None, per_host_limit=None, timeout=None, retries=None, backoff=0.5):
+        self.max_connections = max_connections or int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+        self.per_host_limit = per_host_limit or int(os.getenv('HTTP_PER_HOST_LIMIT', '20'))
+        self.timeout = timeout or float(os.getenv('HTTP_TIMEOUT_SECONDS', '60'))
+        self.retries = retries if retries is not None else int(os.getenv('HTTP_RETRIES', '3'))
+        self.backoff = backoff
+        self.client = None
+        self.host_limits = {}
+
+    def _get_client(self):
+        # Created lazily so it binds to the event loop that first uses it
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=10),
+                follow_redirects=True,
+            )
+        return self.client
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self.per_host_limit)
+            self.host_limits[host] = limit
+        return limit
+
+    async def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures, and return the successful response."""
+        client = self._get_client()
+        attempt = 0
+        while True:
+            try:
+                async with self._host_limit(url):
+                    response = await client.request(method, url, **kwargs)
+                if self._retryable_status(method, response.status_code) and attempt < self.retries:
+                    raise httpx.HTTPStatusError(
+                        f"Retryable status {response.status_code}", request=response.request, response=response
+                    )
+                response.raise_for_status()
+                return response
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError):
+                    retryable = self._retryable_status(method, e.response.status_code)
+                elif method.upper() in IDEMPOTENT_METHODS:
+                    retryable = True
+                else:
+                    retryable = isinstance(e, POST_RETRY_ERRORS)
+                if not retryable or attempt >= self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                attempt += 1
+                print(f"Warning: {method} {url} failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retryable_status(method, status_code):
+        if method.upper() in IDEMPOTENT_METHODS:
+            return status_code in RETRY_STATUS_CODES
+        return status_code in POST_RETRY_STATUS_CODES
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
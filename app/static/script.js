@@ -28,14 +28,20 @@ function generateImage() {
     })
         .then(response => response.json())
         .then(data => {
+            if (data.detail || data.error) {
+                throw new Error(data.detail || data.error);
+            }
+            return streamJob(data.job_id, data.follower_id, loadingMessage);
+        })
+        .then(job => {
             loadingMessage.style.display = 'none';
             generateButton.style.display = 'block';
 
-            if (data.error) {
-                alert(data.error);
+            if (!job.result) {
+                alert(job.error);
             } else {
                 const img = document.createElement('img');
-                img.src = `data:image/png;base64,${data.image}`;
+                img.src = job.result.image_url;
                 imageContainer.appendChild(img);
             }
         })
@@ -47,31 +53,133 @@ function generateImage() {
         });
 }
 
-function fetchHistory() {
+function streamJob(jobId, followerId, loadingMessage) {
+    const progressContainer = document.getElementById('progress-container');
+    progressContainer.innerHTML = '';
+    loadingMessage.textContent = 'Generating image... Please wait.';
+
+    return new Promise((resolve, reject) => {
+        const events = new EventSource(`/api/jobs/${jobId}/events`);
+        // Reconnects resume from the Last-Event-ID; skip anything already shown regardless
+        let lastEventId = 0;
+
+        events.addEventListener('round', event => {
+            const eventId = Number(event.lastEventId);
+            if (eventId && eventId <= lastEventId) {
+                return;
+            }
+            lastEventId = eventId || lastEventId;
+            const round = JSON.parse(event.data);
+            loadingMessage.textContent = `Generating image... round ${round.round} scored ${round.overall_score}/10.`;
+            progressContainer.appendChild(renderRound(round, accept));
+        });
+
+        const finish = job => {
+            events.close();
+            progressContainer.innerHTML = '';
+            resolve(job);
+        };
+
+        // If other clients share the job it keeps running for them, and we leave with the best image so far
+        const accept = () => {
+            const query = followerId ? `?follower_id=${encodeURIComponent(followerId)}` : '';
+            fetch(`/api/jobs/${jobId}/accept${query}`, { method: 'POST' })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status === 'detached' && data.result) {
+                        finish({ status: 'completed', result: data.result });
+                    }
+                })
+                .catch(error => console.error('Error:', error));
+        };
+
+        events.addEventListener('done', event => finish(JSON.parse(event.data)));
+
+        events.onerror = error => {
+            if (events.readyState === EventSource.CLOSED) {
+                reject(error);
+            }
+        };
+    });
+}
+
+function renderRound(round, accept) {
+    const item = document.createElement('div');
+    item.className = 'round';
+
+    if (round.thumbnail_url) {
+        const img = document.createElement('img');
+        img.src = round.thumbnail_url;
+        item.appendChild(img);
+    }
+
+    const summary = document.createElement('p');
+    const label = round.final ? `Final review (${round.evaluator_model})` : `Round ${round.round}`;
+    summary.textContent = `${label} - score ${round.overall_score}/10: ${round.overall_feedback}`;
+    item.appendChild(summary);
+
+    if (round.final) {
+        // The job is finishing; there is nothing left to accept early
+        return item;
+    }
+
+    const acceptButton = document.createElement('button');
+    acceptButton.textContent = 'Use the best image so far';
+    acceptButton.onclick = () => {
+        acceptButton.disabled = true;
+        accept();
+    };
+    item.appendChild(acceptButton);
+    return item;
+}
+
+let historyCursor = null;
+
+function fetchHistory(loadMore = false) {
     const historyLoadingMessage = document.getElementById('history-loading-message');
     const historyButton = document.getElementById('history-button');
+    const historyMoreButton = document.getElementById('history-more-button');
     const historyContainer = document.getElementById('history-container');
 
+    if (!loadMore) {
+        historyCursor = null;
+        historyContainer.innerHTML = '';
+    }
+
     historyLoadingMessage.style.display = 'block';
     historyButton.style.display = 'none';
-    historyContainer.innerHTML = '';
+    historyMoreButton.style.display = 'none';
 
-    fetch('/api/get_images')
+    const params = new URLSearchParams({ limit: 20 });
+    if (historyCursor) {
+        params.set('cursor', historyCursor);
+    }
+
+    fetch(`/api/get_images?${params}`)
         .then(response => response.json())
         .then(data => {
             historyLoadingMessage.style.display = 'none';
             historyButton.style.display = 'block';
 
-            if (data.images.length === 0) {
+            if (data.images.length === 0 && !loadMore) {
                 historyContainer.innerHTML = '<p>No images found.</p>';
                 return;
             }
 
             data.images.forEach(image => {
+                const link = document.createElement('a');
+                link.href = image.url;
+                link.target = '_blank';
                 const img = document.createElement('img');
-                img.src = `data:image/png;base64,${image.image_base64}`;
-                historyContainer.appendChild(img);
+                img.src = image.thumbnail_url;
+                img.loading = 'lazy';
+                img.alt = image.id;
+                link.appendChild(img);
+                historyContainer.appendChild(link);
             });
+
+            historyCursor = data.next_cursor;
+            historyMoreButton.style.display = historyCursor ? 'block' : 'none';
         })
         .catch(error => {
             historyLoadingMessage.style.display = 'none';
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app imports its packages (models, services, ...) relative to app/
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture(autouse=True)
+def app_working_directory(monkeypatch):
+    # Data files such as the prompt template are opened relative to app/, as when the server runs
+    monkeypatch.chdir(APP_DIR)
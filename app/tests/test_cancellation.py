@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from models.cancellation import CancellationToken
+from models.job_manager import JobManager
+
+
+def test_run_cancels_unfinished_tasks_and_keeps_finished_ones():
+    async def scenario():
+        token = CancellationToken()
+        fast = asyncio.create_task(asyncio.sleep(0, result='done'))
+        slow = asyncio.create_task(asyncio.sleep(10))
+        asyncio.get_running_loop().call_later(0.05, token.cancel)
+        await token.run([fast, slow])
+        return token, fast, slow
+
+    token, fast, slow = asyncio.run(scenario())
+
+    assert token.reason == 'cancelled'
+    assert fast.result() == 'done'
+    assert slow.cancelled()
+
+
+def test_run_cancels_tasks_at_the_deadline():
+    async def scenario():
+        token = CancellationToken(timeout=0.05)
+        slow = asyncio.create_task(asyncio.sleep(10))
+        started = time.monotonic()
+        await token.run([slow])
+        return token, slow, time.monotonic() - started
+
+    token, slow, seconds = asyncio.run(scenario())
+
+    assert token.reason == 'deadline'
+    assert slow.cancelled()
+    assert seconds < 5
+
+
+async def _wait_until_cancelled(on_round, should_stop, cancel_token):
+    await cancel_token.run([asyncio.create_task(asyncio.sleep(10))])
+    return {'stop_reason': cancel_token.reason}
+
+
+def _wait_for_status(manager, job_id, statuses, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.02)
+    return manager.get(job_id)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(str(tmp_path / "jobs.db"), max_workers=2, poll_interval=0.05, abandon_seconds=0.2)
+    yield manager
+    manager.shutdown(wait=False)
+
+
+def test_leased_job_nobody_follows_is_abandoned(manager):
+    job_id, _ = manager.submit(_wait_until_cancelled)
+
+    job = _wait_for_status(manager, job_id, ('cancelled', 'completed', 'failed'))
+
+    assert job['status'] == 'cancelled'
+    assert job['result']['stop_reason'] == 'abandoned'
+
+
+def test_job_without_lease_is_not_abandoned(manager):
+    job_id, _ = manager.submit(_wait_until_cancelled, lease=False)
+    time.sleep(0.5)
+
+    assert manager.get(job_id)['status'] == 'running'
+    manager.request_cancel(job_id)
+    job = _wait_for_status(manager, job_id, ('cancelled', 'completed', 'failed'))
+    assert job['result']['stop_reason'] == 'cancelled'
+
+
+def test_earliest_deadline_sets_the_stop_reason():
+    token = CancellationToken()
+    token.limit(60)
+    token.limit(0.01, reason='job_timeout')
+    token.limit(30)
+    time.sleep(0.02)
+
+    assert token.cancelled
+    assert token.reason == 'job_timeout'
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+pytest.importorskip('numpy')
+
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('IMAGES_DATA_DIR', str(tmp_path))
+    monkeypatch.setenv('IMAGE_BACKEND', 'fake')
+    monkeypatch.setenv('EVALUATOR_BACKEND', 'fake')
+    monkeypatch.setenv('FAKE_GENERATOR_LATENCY', '0.01')
+    monkeypatch.setenv('FAKE_EVALUATOR_LATENCY', '0.01')
+    monkeypatch.setenv('FAKE_GENERATOR_SIZE', '64')
+    import main
+    monkeypatch.setattr(main, 'image_generator_router', None)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def wait_for_job(client, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job['status'] in ('completed', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_generate_image_completes_with_fake_backends(client):
+    response = client.post("/api/generate_image", json={'user_input': 'a lighthouse at dusk', 'rounds': 2})
+    assert response.status_code == 202
+
+    job = wait_for_job(client, response.json()['job_id'])
+
+    assert job['status'] == 'completed', job['error']
+    assert job['result']['local_filename']
+    assert client.get(job['result']['image_url']).status_code == 200
+
+
+def test_identical_request_is_served_from_the_result_cache(client):
+    body = {'user_input': 'a red bicycle', 'rounds': 1}
+    first = client.post("/api/generate_image", json=body).json()
+    assert wait_for_job(client, first['job_id'])['status'] == 'completed'
+
+    second = client.post("/api/generate_image", json=body).json()
+
+    assert second['cached'] is True
+    assert wait_for_job(client, second['job_id'])['status'] == 'completed'
+
+
+def test_cancel_by_one_client_leaves_shared_job_running_for_the_other(client):
+    import main
+    main.get_router().image_generator.generator.latency = 0.3
+    body = {'user_input': 'a shared harbour scene', 'rounds': 2}
+    first = client.post("/api/generate_image", json=body).json()
+    second = client.post("/api/generate_image", json=body).json()
+    assert second['coalesced'] and second['job_id'] == first['job_id']
+
+    response = client.post(f"/api/jobs/{first['job_id']}/cancel", params={'follower_id': first['follower_id']})
+
+    assert response.json()['status'] == 'detached'
+    assert wait_for_job(client, second['job_id'])['status'] == 'completed'
+
+
+def test_result_cut_short_by_the_job_time_cap_is_not_cached(client):
+    import main
+    router = main.get_router()
+    router.image_generator.generator.latency = 0.05
+    router.job_manager.max_seconds = 0.15
+    body = {'user_input': 'a slow cathedral', 'rounds': 10, 'score_threshold': 0, 'plateau_rounds': 0}
+    first = client.post("/api/generate_image", json=body).json()
+    job = wait_for_job(client, first['job_id'])
+    assert job['result']['stop_reason'] == 'job_timeout'
+
+    second = client.post("/api/generate_image", json=body).json()
+
+    assert second['cached'] is False
+
+
+def test_job_stays_within_max_cost(client):
+    body = {'user_input': 'a budget lighthouse', 'beam_width': 8, 'rounds': 3, 'max_cost': 0.1}
+    job = wait_for_job(client, client.post("/api/generate_image", json=body).json()['job_id'])
+
+    assert job['status'] == 'completed', job['error']
+    assert job['result']['estimated_cost'] <= 0.1
+
+
+def test_variant_requests_snap_to_a_fixed_set(client, tmp_path):
+    body = {'user_input': 'a small variant', 'rounds': 1}
+    job = wait_for_job(client, client.post("/api/generate_image", json=body).json()['job_id'])
+    image_url = job['result']['image_url']
+
+    for quality, max_dim in [(81, 100), (82, 120), (79, 128), (10, 4000), (11, 3000)]:
+        response = client.get(image_url, params={'format': 'jpeg', 'quality': quality, 'max_dim': max_dim})
+        assert response.status_code == 200
+
+    assert len(list((tmp_path / 'variants').iterdir())) == 2
+
+
+def test_job_events_carry_ids_and_resume_after_last_event_id(client):
+    body = {'user_input': 'a streamed mountain', 'rounds': 2, 'score_threshold': 0, 'plateau_rounds': 0}
+    job_id = client.post("/api/generate_image", json=body).json()['job_id']
+    job = wait_for_job(client, job_id)
+    rounds = len(job['progress']['rounds'])
+    assert rounds == 2
+
+    full = client.get(f"/api/jobs/{job_id}/events").text
+    resumed = client.get(f"/api/jobs/{job_id}/events", headers={'Last-Event-ID': '1'}).text
+
+    assert full.count("event: round") == rounds and "id: 1\n" in full and "id: 2\n" in full
+    assert resumed.count("event: round") == rounds - 1 and "id: 1\n" not in resumed
+    assert "event: done" in resumed
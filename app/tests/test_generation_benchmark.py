@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+pytest.importorskip('numpy')
+
+from benchmarks import generation_benchmark
+
+
+@pytest.fixture
+def fake_backends(tmp_path, monkeypatch):
+    monkeypatch.setenv('IMAGES_DATA_DIR', str(tmp_path))
+    monkeypatch.setenv('IMAGE_BACKEND', 'fake')
+    monkeypatch.setenv('EVALUATOR_BACKEND', 'fake')
+    monkeypatch.setenv('FAKE_GENERATOR_LATENCY', '0.01')
+    monkeypatch.setenv('FAKE_EVALUATOR_LATENCY', '0.01')
+    monkeypatch.setenv('FAKE_GENERATOR_SIZE', '64')
+    import main
+    monkeypatch.setattr(main, 'image_generator_router', None)
+    yield
+    if main.image_generator_router is not None:
+        main.image_generator_router.shutdown()
+
+
+def test_benchmark_smoke(fake_backends, capsys):
+    generation_benchmark.main(['--requests', '4', '--concurrency', '2', '--rounds', '2'])
+
+    output = capsys.readouterr().out
+    assert "completed: 4  failures: 0" in output
+    assert "Latency p50:" in output and "p95:" in output and "p99:" in output
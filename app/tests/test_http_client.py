@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from services.http_client import AsyncHttpClient
+
+URL = "https://queue.example.com/fal-ai/model"
+
+
+def send(method, outcomes, retries=2):
+    """Send one request through a mock transport that yields outcomes in turn.
+
+    Each outcome is a status code or an exception class. Returns (attempts, result),
+    where result is the final status code or the exception raised.
+    """
+    attempts = []
+
+    def handler(request):
+        outcome = outcomes[min(len(attempts), len(outcomes) - 1)]
+        attempts.append(request.method)
+        if isinstance(outcome, int):
+            return httpx.Response(outcome, request=request)
+        raise outcome("mock failure", request=request)
+
+    async def run():
+        client = AsyncHttpClient(retries=retries, backoff=0)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return (await client.request(method, URL)).status_code
+        except httpx.HTTPStatusError as e:
+            return e.response.status_code
+        except httpx.TransportError as e:
+            return type(e)
+        finally:
+            await client.aclose()
+
+    result = asyncio.run(run())
+    return len(attempts), result
+
+
+@pytest.mark.parametrize("failure", [httpx.ConnectError, httpx.ConnectTimeout, 429])
+def test_post_is_retried_when_it_cannot_have_been_processed(failure):
+    assert send("POST", [failure, 200]) == (2, 200)
+
+
+@pytest.mark.parametrize("failure", [500, 502, 503, 504, httpx.ReadTimeout, httpx.ReadError])
+def test_post_is_not_retried_once_it_may_have_reached_the_server(failure):
+    assert send("POST", [failure, 200]) == (1, failure)
+
+
+@pytest.mark.parametrize("failure", [500, 502, 503, 504, 408, 429,
+                                     httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ConnectError])
+def test_get_is_retried_on_server_errors_and_timeouts(failure):
+    assert send("GET", [failure, 200]) == (2, 200)
+
+
+def test_get_is_not_retried_on_client_errors():
+    assert send("GET", [404, 200]) == (1, 404)
+
+
+def test_retries_stop_after_the_limit():
+    assert send("GET", [503], retries=2) == (3, 503)
+    assert send("POST", [httpx.ConnectError], retries=2) == (3, httpx.ConnectError)
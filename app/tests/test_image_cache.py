@@ -0,0 +1,43 @@
+import os
+
+from models.image_cache import ImageCache
+
+
+def spilled_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if not name.endswith('.tmp'))
+
+
+def test_spill_directory_stays_within_its_budget(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=100, max_spill_bytes=250)
+    digests = [cache.put(bytes([i]) * 100) for i in range(6)]
+
+    total = sum(os.path.getsize(tmp_path / name) for name in spilled_files(tmp_path))
+    assert total <= 250
+    # The newest blob is in memory, the most recently spilled ones are on disk, the oldest are gone
+    assert cache.get(digests[-1]) is not None
+    assert cache.get(digests[-2]) == bytes([4]) * 100
+    assert cache.get(digests[0]) is None
+
+
+def test_reading_a_spilled_blob_keeps_it_from_being_deleted_first(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=100, max_spill_bytes=200)
+    first = cache.put(b'a' * 100)
+    second = cache.put(b'b' * 100)
+    cache.put(b'c' * 100)
+    # first and second are spilled; reading first makes second the least recently used
+    assert cache.get(first) == b'a' * 100
+    cache.put(b'd' * 100)
+    cache.put(b'e' * 100)
+
+    assert cache.get(first) == b'a' * 100
+    assert cache.get(second) is None
+
+
+def test_budget_applies_to_spills_left_by_an_earlier_run(tmp_path):
+    for i in range(5):
+        (tmp_path / f"old{i}").write_bytes(b'x' * 100)
+
+    cache = ImageCache(str(tmp_path), max_spill_bytes=250)
+
+    assert len(spilled_files(tmp_path)) == 2
+    assert cache.spilled_bytes == 200
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import pytest
+
+from models.job_manager import JobManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    # A long poll interval, so only a direct wake-up can deliver rounds quickly
+    manager = JobManager(str(tmp_path / "jobs.db"), poll_interval=5, abandon_seconds=0)
+    yield manager
+    manager.shutdown(wait=False)
+
+
+async def _one_round_then_finish(on_round, should_stop, cancel_token):
+    await asyncio.sleep(0.2)
+    await on_round({'round': 1})
+    await asyncio.sleep(0.2)
+    return {'stop_reason': 'max_rounds'}
+
+
+def test_many_waiters_are_woken_without_holding_threads(manager):
+    job_id, _ = manager.submit(_one_round_then_finish)
+
+    async def wait_all():
+        # Far more waiters than the default executor has threads
+        return await asyncio.gather(*(manager.wait_for_update(job_id, 0, timeout=10) for _ in range(200)))
+
+    started = time.monotonic()
+    jobs = asyncio.run(wait_all())
+
+    assert all(len(job['progress']['rounds']) >= 1 for job in jobs)
+    assert time.monotonic() - started < 3
+
+
+def test_wait_for_update_returns_the_snapshot_on_timeout(manager):
+    job_id, _ = manager.submit(_one_round_then_finish)
+
+    job = asyncio.run(manager.wait_for_update(job_id, 5, timeout=0.05))
+
+    assert job['status'] in ('queued', 'running')
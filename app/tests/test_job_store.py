@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import pytest
+
+from models.job_store import JobStore
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def _create_in_worker(db_file, key, start, done, results):
+    store = JobStore(db_file)
+    start.wait()
+    results.put(store.create(key))
+    # Stay alive until every worker has created, so the winner's job is not an orphan yet
+    done.wait()
+
+
+def test_concurrent_create_in_two_workers_coalesces(db_file):
+    JobStore(db_file)
+    context = multiprocessing.get_context('fork')
+    start, done = context.Barrier(2), context.Barrier(2)
+    results = context.Queue()
+    workers = [
+        context.Process(target=_create_in_worker, args=(db_file, 'same-key', start, done, results))
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(30)
+
+    assert len({job_id for job_id, _ in outcomes}) == 1
+    assert sorted(coalesced for _, coalesced in outcomes) == [False, True]
+
+
+def test_create_joins_job_of_live_worker(db_file):
+    store = JobStore(db_file)
+    job_id, coalesced = store.create('key')
+    store.update(job_id, status='running')
+
+    assert store.create('key') == (job_id, True)
+    assert store.create('other-key')[0] != job_id
+
+
+def test_fail_orphans_fails_jobs_of_exited_worker(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key')
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    store.conn.execute("UPDATE jobs SET owner = ?, status = 'running' WHERE id = ?", (f"{exited.pid}:old", job_id))
+
+    JobStore(db_file).fail_orphans()
+
+    job = store.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == "Worker process exited before the job finished"
+
+
+def test_restarted_worker_with_same_pid_does_not_join_old_job(db_file):
+    # A restarted container worker is often given its predecessor's pid (e.g. PID 1)
+    old = JobStore(db_file)
+    job_id, _ = old.create('key')
+    old.update(job_id, status='running')
+
+    restarted = JobStore(db_file)
+    restarted.fail_orphans()
+
+    assert restarted.get(job_id)['status'] == 'failed'
+    new_id, coalesced = restarted.create('key')
+    assert new_id != job_id and not coalesced
+
+
+def test_bare_pid_owner_from_older_database(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key')
+    store.conn.execute("UPDATE jobs SET owner = ? WHERE id = ?", (os.getpid(), job_id))
+
+    store.fail_orphans()
+
+    assert store.get(job_id)['status'] == 'failed'
+
+
+def test_cancel_by_one_follower_detaches_from_shared_job(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key', follower='a')
+    store.create('key', follower='b')
+
+    assert store.request_cancel(job_id, 'a') == 'detached'
+    assert store.cancel_signals([job_id]) == {}
+    assert store.request_cancel(job_id, 'b') == 'cancelling'
+    assert store.cancel_signals([job_id]) == {job_id: 'cancelled'}
+
+
+def test_stop_by_one_follower_detaches_from_shared_job(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key', follower='a')
+    store.create('key', follower='batch')
+
+    assert store.request_stop(job_id, 'a') == 'detached'
+    assert not store.stop_requested(job_id)
+    assert store.request_stop(job_id, 'batch') == 'stopping'
+    assert store.stop_requested(job_id)
+
+
+def test_caller_that_does_not_follow_a_shared_job_cannot_cancel_it(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key', follower='a')
+    store.create('key', follower='b')
+
+    assert store.request_cancel(job_id) == 'shared'
+    assert store.request_cancel(job_id, 'stranger') == 'shared'
+    assert store.cancel_signals([job_id]) == {}
+
+
+def test_cancel_finished_job_returns_none(db_file):
+    store = JobStore(db_file)
+    job_id, _ = store.create('key', follower='a')
+    store.update(job_id, status='completed')
+
+    assert store.request_cancel(job_id, 'a') is None
@@ -0,0 +1,115 @@
+import csv
+
+from models.log_store import LOG_COLUMNS, LogStore
+
+
+def log_row(timestamp, user_prompt, score, filename=None):
+    row = dict.fromkeys(LOG_COLUMNS, '')
+    row.update(timestamp=timestamp, original_user_prompt=user_prompt, prompt=f"{user_prompt} refined",
+               local_filename=filename or f"image_{timestamp}.png", overall_score=str(score))
+    return row
+
+
+def write_csv(path, rows, header=True):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=LOG_COLUMNS)
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_imports_headerless_csv_in_column_order(tmp_path):
+    path = tmp_path / "images_log.csv"
+    write_csv(path, [log_row("2024-01-01T00:00:00", "a cat", 7)], header=False)
+    store = LogStore(str(tmp_path / "log.db"))
+
+    assert store.import_csv(str(path)) == 1
+
+    rows, _ = store.query()
+    assert rows[0]['original_user_prompt'] == "a cat"
+    assert rows[0]['overall_score'] == 7
+    assert rows[0]['width'] is None
+
+
+def test_imports_headered_csv_with_reordered_columns(tmp_path):
+    path = tmp_path / "images_log.csv"
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['overall_score', 'original_user_prompt', 'timestamp'])
+        writer.writerow(['9', 'a dog', '2024-01-02T00:00:00'])
+    store = LogStore(str(tmp_path / "log.db"))
+
+    assert store.import_csv(str(path)) == 1
+
+    rows, _ = store.query()
+    assert rows[0]['original_user_prompt'] == "a dog"
+    assert rows[0]['overall_score'] == 9
+    assert rows[0]['timestamp'] == "2024-01-02T00:00:00"
+
+
+def test_empty_csv_imports_nothing(tmp_path):
+    path = tmp_path / "images_log.csv"
+    path.write_text("")
+    store = LogStore(str(tmp_path / "log.db"))
+
+    assert store.import_csv(str(path)) == 0
+    assert store.query() == ([], None)
+
+
+def test_unreadable_csv_is_left_for_a_later_import(tmp_path):
+    path = tmp_path / "images_log.csv"
+    path.write_text("\n\n")
+    store = LogStore(str(tmp_path / "log.db"))
+
+    assert store.import_csv(str(path)) == 0
+
+    write_csv(path, [log_row("2024-01-01T00:00:00", "a cat", 7)])
+    assert store.import_csv(str(path)) == 1
+
+
+def test_csv_is_imported_only_once(tmp_path):
+    path = tmp_path / "images_log.csv"
+    write_csv(path, [log_row("2024-01-01T00:00:00", "a cat", 7), log_row("2024-01-02T00:00:00", "a dog", 8)])
+    db_file = str(tmp_path / "log.db")
+
+    store = LogStore(db_file, legacy_csv_file=str(path))
+    assert store.import_csv(str(path)) == 0
+    # A second store on the same database (another worker) skips it as well
+    assert LogStore(db_file, legacy_csv_file=str(path)).import_csv(str(path)) == 0
+
+    rows, _ = store.query()
+    assert len(rows) == 2
+
+
+def test_query_filters(tmp_path):
+    store = LogStore(str(tmp_path / "log.db"))
+    store.add_many([
+        log_row("2024-01-01T00:00:00", "a cat", 5),
+        log_row("2024-01-02T00:00:00", "a cat", 9),
+        log_row("2024-01-03T00:00:00", "a dog", 8),
+        log_row("2024-01-04T00:00:00", "a cat", 10),
+    ])
+
+    def timestamps(**filters):
+        return [row['timestamp'][:10] for row in store.query(**filters)[0]]
+
+    assert timestamps(user_prompt="a cat") == ["2024-01-04", "2024-01-02", "2024-01-01"]
+    assert timestamps(min_score=8) == ["2024-01-04", "2024-01-03", "2024-01-02"]
+    assert timestamps(max_score=8) == ["2024-01-03", "2024-01-01"]
+    assert timestamps(since="2024-01-02", until="2024-01-04") == ["2024-01-03", "2024-01-02"]
+    assert timestamps(user_prompt="a cat", min_score=6, max_score=9) == ["2024-01-02"]
+
+
+def test_query_pages_with_cursor(tmp_path):
+    store = LogStore(str(tmp_path / "log.db"))
+    store.add_many([log_row(f"2024-01-{day:02d}T00:00:00", "a cat", day) for day in range(1, 6)])
+
+    pages = []
+    cursor = None
+    while True:
+        rows, cursor = store.query(min_score=2, cursor=cursor, limit=2)
+        pages.append([row['overall_score'] for row in rows])
+        if cursor is None:
+            break
+
+    assert pages == [[5, 4], [3, 2]]
@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from models.prompt_index import PromptIndex
+
+
+def reference_similarity(index, a, b):
+    count = len(index)
+    idf = np.log((1 + count) / (1 + index.document_frequency)) + 1
+    va, vb = index._vectorize(a) * idf, index._vectorize(b) * idf
+    return float(va @ vb / (np.linalg.norm(va) * np.linalg.norm(vb)))
+
+
+def test_suggests_best_prompt_for_a_similar_request():
+    index = PromptIndex()
+    index.add("a cat sitting on a red sofa", "prompt A", 7)
+    index.add("a cat sitting on a red sofa", "prompt B", 9)
+    index.add("a rocket launching at night", "prompt C", 10)
+
+    prompt, score, similarity = index.suggest("a cat sitting on a red couch")
+
+    assert (prompt, score) == ("prompt B", 9)
+    assert similarity == pytest.approx(
+        reference_similarity(index, "a cat sitting on a red sofa", "a cat sitting on a red couch"), rel=1e-4
+    )
+
+
+def test_ignores_low_scores_and_unrelated_requests():
+    index = PromptIndex(min_score=8)
+    index.add("a cat sitting on a red sofa", "prompt A", 5)
+    index.add("a rocket launching at night", "prompt C", 10)
+
+    assert index.suggest("a cat sitting on a red sofa") is None
+
+
+def test_index_grows_past_its_initial_capacity():
+    index = PromptIndex()
+    for i in range(200):
+        index.add(f"request number {i} about lighthouses", f"prompt {i}", 9)
+
+    prompt, _, similarity = index.suggest("request number 150 about lighthouses")
+
+    assert prompt == "prompt 150"
+    assert similarity == pytest.approx(1.0, rel=1e-4)
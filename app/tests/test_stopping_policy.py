@@ -0,0 +1,38 @@
+import pytest
+
+from models.generation_options import GenerationOptions
+from models.stopping_policy import StoppingPolicy
+
+
+def test_first_round_is_shrunk_to_fit_max_cost():
+    policy = StoppingPolicy(max_cost=0.1, image_cost=0.04, evaluation_cost=0.01)
+
+    assert policy.before_round(8) is None
+    assert policy.round_size(8) == 2
+
+
+def test_round_that_fits_is_not_shrunk():
+    policy = StoppingPolicy(max_cost=0.1, image_cost=0.04, evaluation_cost=0.01)
+
+    assert policy.round_size(1) == 1
+    assert StoppingPolicy().round_size(8) == 8
+
+
+def test_stops_when_not_even_one_candidate_fits():
+    policy = StoppingPolicy(max_cost=0.1, image_cost=0.04, evaluation_cost=0.01)
+    policy.after_round(5, generations=1, evaluations=1)
+    policy.after_round(5, generations=1, evaluations=1)
+
+    assert policy.round_size(4) == 0
+    assert policy.before_round(4) == 'max_cost'
+
+
+def test_deadline_is_not_estimated_before_the_first_round():
+    policy = StoppingPolicy(deadline_seconds=0.001)
+
+    assert policy.before_round(1) is None
+
+
+def test_max_cost_below_one_candidate_is_rejected():
+    with pytest.raises(ValueError, match="max_cost"):
+        GenerationOptions(beam_width=8, max_cost=0.01)